@@ -1,22 +1,50 @@
 # -*- coding: utf-8 -*-
 import os
 import sys
+import io
+import re
+import json
+import time
+import uuid
+import hashlib
+import random
+import signal
+import socket
+import sqlite3
 import asyncio
 import logging
+import functools
+import threading
+import subprocess
+from collections import deque
+from concurrent.futures import ThreadPoolExecutor
 from datetime import datetime
 from dotenv import load_dotenv
 
+import aiohttp
 import discord
 from discord.ext import commands, tasks
 
 # =========================
 #        CONFIG
 # =========================
-# 👉 Aggiorna questi ID in base al tuo server
+# 👉 Config del server "storico": all'avvio diventa la config salvata del server che
+#    contiene TARGET_CHANNEL_ID. Gli altri server si configurano con !setup.
 TARGET_CHANNEL_ID = 1420493501984149585   # canale di destinazione per i report/todo
 ALLOWED_CHANNEL_ID = 1280758855336464426  # canale autorizzato per usare i comandi (!bug, !crash, !todo, !status)
 EXPORT_CHANNEL_ID = 1420493501984149585   # canale dove postare l'export pin
 
+# categoria -> sottocategorie proposte nei flow (default per i server senza tassonomia propria)
+DEFAULT_TAXONOMY = {
+    "MAP": ["UI", "VISUAL", "MOVING", "Other"],
+    "SETTLEMENTS": ["Slots", "Buildings", "Loc", "Non selectable", "Other"],
+    "FACTIONS": ["Leader", "Loc", "Flags", "Other"],
+    "ARMIES": ["Generals/Admirals", "Units", "Loc", "Ui", "Other"],
+}
+DEFAULT_BANNED_WORDS = ["shit"]
+MAX_TAXONOMY_BUTTONS = 20  # una view Discord regge al massimo 25 bottoni
+MAX_BUTTON_LABEL = 80      # Discord rifiuta etichette più lunghe (e con loro l'intero messaggio)
+
 # =========================
 #     ENV / TOKEN CHECK
 # =========================
@@ -27,6 +55,90 @@ if not token:
     print("Configura il token Discord nei Secrets del progetto.")
     sys.exit(1)
 
+# cartella per i file di stato locali
+DATA_DIR = os.getenv("DATA_DIR", "data")
+
+# config per server (canali, tassonomia, parole moderate)
+GUILD_CONFIG_FILE = os.path.join(DATA_DIR, "guild_config.json")
+
+# allegati dei crash: store locale indirizzato per contenuto (SHA-256), un file per contenuto
+BLOB_DIR = os.path.join(DATA_DIR, "blobs")
+ATTACHMENT_MAX_BYTES = 8 * 1024 * 1024          # per file
+ATTACHMENTS_PER_REPORT = 3
+ATTACHMENT_CHUNK_SIZE = 64 * 1024               # download a blocchi, mai il file intero in memoria
+BLOB_STORE_MAX_BYTES = 512 * 1024 * 1024        # oltre, si eliminano i blob usati meno di recente
+BLOB_MAX_AGE = 90 * 24 * 3600                   # secondi dall'ultimo uso
+ATTACHMENT_WAIT_TIMEOUT = 60                    # attesa massima del caricamento all'invio del report
+# firma dei crash: si analizzano solo log testuali, e al massimo CRASH_PARSE_MAX_LINES righe
+CRASH_LOG_EXTENSIONS = (".log", ".txt", ".trace", ".crash")
+CRASH_PARSE_MAX_LINES = 20000
+CRASH_SIGNATURE_FRAMES = 5                      # frame in cima allo stack che entrano nella firma
+# export pin: i Crash classificati compaiono anche raggruppati per firma
+EXPORT_GROUP_CRASHES = os.getenv("EXPORT_GROUP_CRASHES", "1") == "1"
+
+# snapshot dello stato scritto allo spegnimento e ricaricato all'avvio
+STATE_FILE = os.path.join(DATA_DIR, "state.json")
+# log eventi append-only: il tail viene rigiocato sopra l'ultimo snapshot, poi archiviato
+EVENT_LOG_FILE = os.path.join(DATA_DIR, "events.log")
+EVENT_ARCHIVE_FILE = os.path.join(DATA_DIR, "events.archive.log")
+EVENT_LOG_FSYNC_INTERVAL = 1.0      # secondi: un solo fsync per batch di eventi
+STATE_SNAPSHOT_INTERVAL = 10 * 60   # secondi tra snapshot periodici (solo se ci sono eventi nuovi)
+# Heroku manda SIGKILL 30s dopo SIGTERM: lasciamo margine per snapshot e close()
+SHUTDOWN_DRAIN_TIMEOUT = 20.0
+
+# health check HTTP locale (liveness /healthz, readiness /readyz)
+HEALTH_HOST = os.getenv("HEALTH_HOST", "127.0.0.1")
+HEALTH_PORT = int(os.getenv("HEALTH_PORT", "8080"))
+HEALTH_MAX_HEARTBEAT_AGE = 15 * 60   # secondi; l'uptime monitor batte ogni 5 minuti
+HEALTH_MAX_LOOP_LAG_MS = 2000
+# ping nel canale report solo quando lo stato peggiora (disattivabile)
+HEALTH_ALERT_PING = os.getenv("HEALTH_ALERT_PING", "1") == "1"
+HEALTH_ALERT_CHANNEL_ID = int(os.getenv("HEALTH_ALERT_CHANNEL_ID", TARGET_CHANNEL_ID))
+
+# supervisor di riconnessione: backoff esponenziale con jitter e budget di errori a finestra mobile
+RECONNECT_BASE_DELAY = 2.0          # secondi
+RECONNECT_MAX_DELAY = 300.0         # secondi
+RECONNECT_FAILURE_WINDOW = 60 * 60  # secondi
+
+
+def _failures_covering_window() -> int:
+    """Errori che il backoff (al ritardo minimo col jitter) distribuisce su tutta la finestra.
+
+    Un disservizio continuo quindi non esaurisce mai il budget: il backoff arriva a RECONNECT_MAX_DELAY
+    e riprova per tutta la finestra. Lo esauriscono solo connessioni che cadono subito dopo essere
+    riuscite (il backoff riparte da RECONNECT_BASE_DELAY), cioè un flapping che non si risolve da solo.
+    """
+    elapsed, failures = 0.0, 0
+    while elapsed < RECONNECT_FAILURE_WINDOW:
+        failures += 1
+        elapsed += min(RECONNECT_MAX_DELAY, RECONNECT_BASE_DELAY * 2 ** (failures - 1)) / 2
+    return failures
+
+
+RECONNECT_MAX_FAILURES = _failures_covering_window()   # errori ammessi nella finestra prima di arrendersi
+
+# Sharding: SHARD_COUNT/SHARD_IDS attivano AutoShardedBot (AUTO_SHARD=1: conteggio deciso da Discord).
+# Con SHARD_PROCESSES > 1 questo processo fa da launcher e divide gli shard tra processi figli,
+# che condividono lo stato tramite SHARED_STATE_DB (SQLite in WAL sulla stessa macchina).
+SHARD_COUNT = int(os.getenv("SHARD_COUNT", "0")) or None
+SHARD_IDS = [int(x) for x in os.getenv("SHARD_IDS", "").split(",") if x.strip()] or None
+AUTO_SHARD = os.getenv("AUTO_SHARD", "0") == "1"
+SHARD_PROCESSES = int(os.getenv("SHARD_PROCESSES", "1"))
+SHARD_PROCESS_INDEX = os.getenv("SHARD_PROCESS_INDEX")  # impostato dal launcher nei figli
+SHARED_STATE_DB = os.getenv("SHARED_STATE_DB")           # None: stato solo locale
+SHARED_SYNC_INTERVAL = 30       # secondi tra flush metriche shard e refresh config condivise
+EXPORT_LEASE_SECONDS = 60       # un solo processo alla volta pubblica l'export di un server
+LAUNCHER_RESTART_BASE_DELAY = 10  # secondi: backoff esponenziale dei riavvii dei processi shard
+# codici di uscita del processo: il launcher decide se e quando riavviare
+EXIT_LOGIN_FAILURE = 78         # token non valido: inutile riprovare
+EXIT_RECONNECT_BUDGET = 75      # budget di riconnessione esaurito
+
+# Throttling dei flow (!bug/!crash/!todo): token bucket (capacità, token al secondo)
+THROTTLE_USER = (3, 1 / 20)        # 3 di fila, poi 1 ogni 20s per utente
+THROTTLE_CHANNEL = (10, 1 / 6)     # per canale
+THROTTLE_GUILD = (30, 1 / 2)       # per server
+THROTTLE_NOTICE_COOLDOWN = 30      # secondi tra due avvisi allo stesso utente
+
 # =========================
 #        LOGGING
 # =========================
@@ -34,7 +146,9 @@ logging.basicConfig(
     level=logging.INFO,
     format="%(asctime)s - %(levelname)s - %(message)s",
     handlers=[
-        logging.FileHandler("discord.log", encoding="utf-8", mode="w"),
+        logging.FileHandler(
+            f"discord-{SHARD_PROCESS_INDEX}.log" if SHARD_PROCESS_INDEX else "discord.log", encoding="utf-8", mode="w"
+        ),
         logging.FileHandler("uptime.log", encoding="utf-8", mode="a"),
         logging.StreamHandler(sys.stdout),
     ],
@@ -48,30 +162,621 @@ bot_start_time: datetime = datetime.now()
 last_heartbeat: datetime = datetime.now()
 disconnection_count: int = 0
 reconnection_attempts: int = 0
+gateway_connected: bool = False
+loop_lag_ms: float = 0.0
+
+_reconnect_failures = deque()         # time.monotonic() degli errori recenti (finestra mobile)
+_consecutive_failures: int = 0        # azzerato a ogni connessione riuscita
+_outage_started = None                # time.monotonic() dell'inizio del disservizio in corso
+recovery_times = deque(maxlen=20)     # durate (s) degli ultimi recuperi
+
+# Spegnimento controllato (SIGTERM): niente nuovi flow, si attende chi è in corso
+_shutting_down: bool = False
+_shutdown_event = asyncio.Event()     # sveglia il supervisor durante il backoff
+_inflight_flows: int = 0              # handler di modal/bottoni in esecuzione
+_background_tasks = set()             # task in uscita (es. pubblicazione export) da drenare
+
+# Log eventi: sequenza globale e buffer in attesa di fsync
+_event_seq: int = 0
+_event_buffer = []                    # righe JSON non ancora scritte su disco
+_event_log_lock = asyncio.Lock()      # serializza flush e compattazione
+_snapshot_event_seq: int = 0          # ultimo evento incluso nello snapshot su disco
+
+# Stato dei report separato per server: ID, report classificati ed export sono per guild.
+# LEGACY_GUILD_ID raccoglie lo stato salvato prima del multi-server; all'avvio passa
+# al server che contiene TARGET_CHANNEL_ID (vedi _seed_legacy_guild).
+LEGACY_GUILD_ID = 0
+_report_counters = {}     # guild_id -> prossimo ID report
+classified_reports = {}   # guild_id -> {report_id -> dict}
+export_message_ids = {}   # guild_id -> ID del messaggio export fissato
+
+# Indice dei crash per firma: crash_buckets[guild_id][signature] = {
+#   "title": str, "count": int, "first_seen_version": str, "first_seen_report": int, "report_ids": [int]
+# }
+crash_buckets = {}
 
-REPORT_COUNTER: int = 1
-classified_reports = {}  # report_id -> dict
-export_message_id = None
+# Rendering export fuori dall'event loop: un solo worker, così i render
+# restano in ordine e quelli vecchi ancora in coda si possono annullare.
+_export_executor = ThreadPoolExecutor(max_workers=1, thread_name_prefix="export")
+_export_generations = {}        # guild_id -> contatore richieste di export
+_export_render_futures = {}     # guild_id -> render in coda/in corso (asyncio.Future)
+_export_publish_locks = {}      # guild_id -> asyncio.Lock
 
 # Stato temporaneo durante la compilazione:
-# _active_reports[author_id] = {
+# _active_reports[(guild_id, author_id)] = {
 #   "arr": [display_name, version, date, category, subcategory, description],
 #   "report_type": "Bug"|"Crash"|"Todo",
+#   "guild_id": int,
 #   "origin_channel_id": int,
 #   "report_id": int,
-#   "message_ts": datetime
+#   "message_ts": datetime,
+#   "attachments_task": asyncio.Task   # solo !crash con allegati -> list[dict] (vedi store_attachments)
 # }
 _active_reports = {}
 
 # Metadati per bottoni priorità:
 # _report_meta[report_message_id] = {
 #   "report_type": "Bug"|"Crash"|"Todo",
+#   "guild_id": int,
 #   "origin_channel_id": int,
 #   "author_id": int,
-#   "report_id": int
+#   "report_id": int,
+#   "attachments": [{"sha256", "filename", "size", "content_type"}],
+#   "crash_signature": str   # impostata dopo l'analisi dei log (vedi bucket_crash_report)
 # }
 _report_meta = {}
 
+
+def spawn_background(coro, name: str) -> asyncio.Task:
+    """Avvia un task in uscita tenendone traccia per il drain allo spegnimento."""
+    task = asyncio.create_task(coro, name=name)
+    _background_tasks.add(task)
+    task.add_done_callback(_background_tasks.discard)
+    return task
+
+
+def tracks_inflight(func):
+    """Conta l'handler come flow in corso finché non termina."""
+    @functools.wraps(func)
+    async def wrapper(*args, **kwargs):
+        global _inflight_flows
+        _inflight_flows += 1
+        try:
+            return await func(*args, **kwargs)
+        finally:
+            _inflight_flows -= 1
+    return wrapper
+
+
+# Metriche per shard (throughput): _shard_metrics[shard_id] = {"commands", "reports", "priority_changes"}
+_shard_metrics = {}
+_shard_rates = {}         # shard_id -> ultime metriche calcolate (eventi/min, latenza), per !status
+
+
+async def allocate_report_id(guild_id: int) -> int:
+    """Assegna il prossimo ID report del server (atomico tra processi se c'è lo stato condiviso)."""
+    floor = _report_counters.get(guild_id, 1)
+    if _shared_store:
+        # transazione SQLite (può attendere il lock): fuori dall'event loop
+        report_id = await asyncio.to_thread(_shared_store.allocate_report_id, guild_id, floor)
+    else:
+        report_id = floor
+    _report_counters[guild_id] = max(_report_counters.get(guild_id, 1), report_id + 1)
+    return report_id
+
+
+def shard_for_guild(guild_id: int) -> int:
+    """Shard che gestisce il server (formula di Discord)."""
+    shard_count = (bot.shard_count if bot else None) or 1
+    return (guild_id >> 22) % shard_count
+
+
+def count_shard_metric(guild_id: int, key: str):
+    counters = _shard_metrics.setdefault(
+        shard_for_guild(guild_id), {"commands": 0, "reports": 0, "priority_changes": 0}
+    )
+    counters[key] += 1
+
+
+# =========================
+#      GUILD CONFIG
+# =========================
+# Config durevole per server (GUILD_CONFIG_FILE):
+# _guild_config_store[guild_id] = {
+#   "target_channel_id": int|None,   # None: il report resta nel canale del comando
+#   "allowed_channel_id": int|None,  # None: comandi ammessi ovunque
+#   "export_channel_id": int|None,   # None: nessun export pin
+#   "taxonomy": {categoria: [sottocategorie]},
+#   "banned_words": [str]
+# }
+_guild_config_store = {}
+# Config risolte (default applicati, parole in minuscolo): lookup O(1) negli handler.
+# Va invalidata a ogni modifica dello store.
+_guild_config_cache = {}
+
+
+def _resolve_guild_config(stored: dict) -> dict:
+    return {
+        "target_channel_id": stored.get("target_channel_id"),
+        "allowed_channel_id": stored.get("allowed_channel_id"),
+        "export_channel_id": stored.get("export_channel_id"),
+        "taxonomy": stored.get("taxonomy") or DEFAULT_TAXONOMY,
+        "banned_words": tuple(w.lower() for w in stored.get("banned_words", DEFAULT_BANNED_WORDS)),
+    }
+
+
+def get_guild_config(guild_id: int) -> dict:
+    cfg = _guild_config_cache.get(guild_id)
+    if cfg is None:
+        cfg = _guild_config_cache[guild_id] = _resolve_guild_config(_guild_config_store.get(guild_id, {}))
+    return cfg
+
+
+def invalidate_guild_config(guild_id: int = None):
+    if guild_id is None:
+        _guild_config_cache.clear()
+    else:
+        _guild_config_cache.pop(guild_id, None)
+
+
+def load_guild_configs():
+    """Carica le config salvate (all'avvio, prima di connettersi)."""
+    if _shared_store:
+        _guild_config_store.clear()
+        _guild_config_store.update(_shared_store.load_guild_configs())
+        invalidate_guild_config()
+        logger.info(f"⚙️ Config condivise caricate per {len(_guild_config_store)} server")
+        return
+    try:
+        with open(GUILD_CONFIG_FILE, encoding="utf-8") as f:
+            data = json.load(f)
+    except FileNotFoundError:
+        return
+    except (OSError, ValueError) as e:
+        logger.error(f"❌ Config server illeggibile ({GUILD_CONFIG_FILE}): {e}")
+        return
+    _guild_config_store.clear()
+    _guild_config_store.update({int(gid): cfg for gid, cfg in data.items()})
+    invalidate_guild_config()
+    logger.info(f"⚙️ Config caricate per {len(_guild_config_store)} server")
+
+
+async def update_guild_config(guild_id: int, **changes):
+    """Aggiorna la config di un server, la salva su disco e invalida la cache."""
+    stored = dict(_guild_config_store.get(guild_id, {}))
+    stored.update(changes)
+    _guild_config_store[guild_id] = stored
+    if _shared_store:
+        await asyncio.to_thread(_shared_store.save_guild_config, guild_id, stored)
+    else:
+        data = {str(gid): cfg for gid, cfg in _guild_config_store.items()}
+        await asyncio.to_thread(_write_json_atomic, GUILD_CONFIG_FILE, json.dumps(data, ensure_ascii=False))
+    invalidate_guild_config(guild_id)
+
+
+async def _seed_legacy_guild():
+    """Il server che contiene TARGET_CHANNEL_ID eredita le costanti e lo stato pre multi-server."""
+    ch = bot.get_channel(TARGET_CHANNEL_ID)
+    guild = getattr(ch, "guild", None)
+    if not guild:
+        return
+    if guild.id not in _guild_config_store:
+        await update_guild_config(
+            guild.id,
+            target_channel_id=TARGET_CHANNEL_ID,
+            allowed_channel_id=ALLOWED_CHANNEL_ID,
+            export_channel_id=EXPORT_CHANNEL_ID,
+        )
+        logger.info(f"⚙️ Config storica assegnata al server {guild.name} ({guild.id})")
+
+    moved = 0
+    legacy_reports = classified_reports.pop(LEGACY_GUILD_ID, {})
+    if legacy_reports:
+        classified_reports.setdefault(guild.id, {}).update(legacy_reports)
+        moved += len(legacy_reports)
+    if LEGACY_GUILD_ID in _report_counters:
+        legacy_next = _report_counters.pop(LEGACY_GUILD_ID)
+        _report_counters[guild.id] = max(_report_counters.get(guild.id, 1), legacy_next)
+    if LEGACY_GUILD_ID in export_message_ids:
+        export_message_ids.setdefault(guild.id, export_message_ids.pop(LEGACY_GUILD_ID))
+    for meta in _report_meta.values():
+        if not meta.get("guild_id"):
+            meta["guild_id"] = guild.id
+    if moved:
+        logger.info(f"♻️ {moved} report pre multi-server assegnati al server {guild.name}")
+
+
+# =========================
+#      SHARED STATE
+# =========================
+class SharedStore:
+    """Stato condiviso tra i processi shard: un file SQLite in WAL sulla stessa macchina.
+
+    Contiene contatori ID, report classificati, metadati dei messaggi report, indice
+    dei crash, config dei server, stato/lease dell'export e metriche per shard.
+    I metodi sono thread-safe: dall'event loop si chiamano con asyncio.to_thread.
+    """
+
+    SCHEMA = """
+        CREATE TABLE IF NOT EXISTS report_counters (
+            guild_id INTEGER PRIMARY KEY,
+            next_id INTEGER NOT NULL
+        );
+        CREATE TABLE IF NOT EXISTS reports (
+            guild_id INTEGER NOT NULL,
+            report_id INTEGER NOT NULL,
+            record TEXT NOT NULL,
+            updated_at REAL NOT NULL,
+            PRIMARY KEY (guild_id, report_id)
+        );
+        CREATE TABLE IF NOT EXISTS report_meta (
+            message_id INTEGER PRIMARY KEY,
+            guild_id INTEGER NOT NULL,
+            meta TEXT NOT NULL,
+            updated_at REAL NOT NULL
+        );
+        CREATE TABLE IF NOT EXISTS crash_buckets (
+            guild_id INTEGER NOT NULL,
+            signature TEXT NOT NULL,
+            bucket TEXT NOT NULL,
+            updated_at REAL NOT NULL,
+            PRIMARY KEY (guild_id, signature)
+        );
+        CREATE TABLE IF NOT EXISTS guild_config (
+            guild_id INTEGER PRIMARY KEY,
+            config TEXT NOT NULL,
+            updated_at REAL NOT NULL
+        );
+        CREATE TABLE IF NOT EXISTS export_state (
+            guild_id INTEGER PRIMARY KEY,
+            message_id INTEGER,
+            lease_owner TEXT,
+            lease_until REAL NOT NULL DEFAULT 0
+        );
+        CREATE TABLE IF NOT EXISTS store_info (
+            key TEXT PRIMARY KEY,
+            value TEXT NOT NULL
+        );
+        CREATE TABLE IF NOT EXISTS shard_metrics (
+            shard_id INTEGER PRIMARY KEY,
+            owner TEXT NOT NULL,
+            guilds INTEGER NOT NULL,
+            latency_ms REAL,
+            commands INTEGER NOT NULL,
+            reports INTEGER NOT NULL,
+            priority_changes INTEGER NOT NULL,
+            events_per_min REAL NOT NULL,
+            updated_at REAL NOT NULL
+        );
+    """
+
+    def __init__(self, path: str):
+        os.makedirs(os.path.dirname(path) or ".", exist_ok=True)
+        self.path = path
+        self.owner = f"{socket.gethostname()}:{os.getpid()}"
+        self._lock = threading.Lock()
+        self._conn = sqlite3.connect(path, timeout=5, isolation_level=None, check_same_thread=False)
+        self._conn.execute("PRAGMA journal_mode=WAL")
+        self._conn.execute("PRAGMA synchronous=NORMAL")
+        self._conn.executescript(self.SCHEMA)
+
+    def _write(self, statements):
+        """Esegue (sql, params) in una transazione IMMEDIATE e ritorna l'ultimo cursore."""
+        with self._lock:
+            self._conn.execute("BEGIN IMMEDIATE")
+            try:
+                cursor = None
+                for sql, params in statements:
+                    cursor = self._conn.execute(sql, params)
+                self._conn.execute("COMMIT")
+                return cursor
+            except Exception:
+                self._conn.execute("ROLLBACK")
+                raise
+
+    def _read(self, sql: str, params=()) -> list:
+        with self._lock:
+            return self._conn.execute(sql, params).fetchall()
+
+    def allocate_report_id(self, guild_id: int, floor: int = 1) -> int:
+        with self._lock:
+            self._conn.execute("BEGIN IMMEDIATE")
+            try:
+                self._conn.execute(
+                    "INSERT INTO report_counters (guild_id, next_id) VALUES (?, ?) "
+                    "ON CONFLICT(guild_id) DO UPDATE SET next_id = MAX(next_id, excluded.next_id)",
+                    (guild_id, floor),
+                )
+                (report_id,) = self._conn.execute(
+                    "SELECT next_id FROM report_counters WHERE guild_id = ?", (guild_id,)
+                ).fetchone()
+                self._conn.execute("UPDATE report_counters SET next_id = ? WHERE guild_id = ?", (report_id + 1, guild_id))
+                self._conn.execute("COMMIT")
+                return report_id
+            except Exception:
+                self._conn.execute("ROLLBACK")
+                raise
+
+    def upsert_report(self, guild_id: int, report_id: int, record: dict):
+        self._write([(
+            "INSERT INTO reports (guild_id, report_id, record, updated_at) VALUES (?, ?, ?, ?) "
+            "ON CONFLICT(guild_id, report_id) DO UPDATE SET record = excluded.record, updated_at = excluded.updated_at",
+            (guild_id, report_id, json.dumps(record, ensure_ascii=False), time.time()),
+        )])
+
+    def load_reports(self, guild_id: int = None) -> dict:
+        """{guild_id: {report_id: record}} (tutti i server se guild_id è None)."""
+        if guild_id is None:
+            rows = self._read("SELECT guild_id, report_id, record FROM reports")
+        else:
+            rows = self._read("SELECT guild_id, report_id, record FROM reports WHERE guild_id = ?", (guild_id,))
+        result = {}
+        for gid, rid, record in rows:
+            result.setdefault(gid, {})[rid] = json.loads(record)
+        return result
+
+    def save_report_meta(self, message_id: int, meta: dict):
+        self._write([(
+            "INSERT INTO report_meta (message_id, guild_id, meta, updated_at) VALUES (?, ?, ?, ?) "
+            "ON CONFLICT(message_id) DO UPDATE SET meta = excluded.meta, updated_at = excluded.updated_at",
+            (message_id, meta.get("guild_id") or 0, json.dumps(meta, ensure_ascii=False), time.time()),
+        )])
+
+    def get_report_meta(self, message_id: int):
+        rows = self._read("SELECT meta FROM report_meta WHERE message_id = ?", (message_id,))
+        return json.loads(rows[0][0]) if rows else None
+
+    def add_to_crash_bucket(self, guild_id: int, report_id: int, info: dict, version: str) -> dict:
+        """Aggiunge il report al bucket della firma (lettura e scrittura nella stessa transazione)."""
+        with self._lock:
+            self._conn.execute("BEGIN IMMEDIATE")
+            try:
+                row = self._conn.execute(
+                    "SELECT bucket FROM crash_buckets WHERE guild_id = ? AND signature = ?",
+                    (guild_id, info["signature"]),
+                ).fetchone()
+                bucket = merge_into_bucket(json.loads(row[0]) if row else None, report_id, info, version)
+                self._conn.execute(
+                    "INSERT INTO crash_buckets (guild_id, signature, bucket, updated_at) VALUES (?, ?, ?, ?) "
+                    "ON CONFLICT(guild_id, signature) DO UPDATE SET bucket = excluded.bucket, "
+                    "updated_at = excluded.updated_at",
+                    (guild_id, info["signature"], json.dumps(bucket, ensure_ascii=False), time.time()),
+                )
+                self._conn.execute("COMMIT")
+                return bucket
+            except Exception:
+                self._conn.execute("ROLLBACK")
+                raise
+
+    def load_crash_buckets(self) -> dict:
+        """{guild_id: {signature: bucket}}"""
+        result = {}
+        for gid, signature, bucket in self._read("SELECT guild_id, signature, bucket FROM crash_buckets"):
+            result.setdefault(gid, {})[signature] = json.loads(bucket)
+        return result
+
+    def load_report_counters(self) -> dict:
+        return dict(self._read("SELECT guild_id, next_id FROM report_counters"))
+
+    def load_guild_configs(self) -> dict:
+        return {gid: json.loads(cfg) for gid, cfg in self._read("SELECT guild_id, config FROM guild_config")}
+
+    def save_guild_config(self, guild_id: int, config: dict):
+        self._write([(
+            "INSERT INTO guild_config (guild_id, config, updated_at) VALUES (?, ?, ?) "
+            "ON CONFLICT(guild_id) DO UPDATE SET config = excluded.config, updated_at = excluded.updated_at",
+            (guild_id, json.dumps(config, ensure_ascii=False), time.time()),
+        )])
+
+    def guild_config_version(self) -> float:
+        (version,) = self._read("SELECT COALESCE(MAX(updated_at), 0) FROM guild_config")[0]
+        return version
+
+    def acquire_export_lease(self, guild_id: int, ttl: float = EXPORT_LEASE_SECONDS) -> bool:
+        now = time.time()
+        cursor = self._write([
+            ("INSERT OR IGNORE INTO export_state (guild_id) VALUES (?)", (guild_id,)),
+            (
+                "UPDATE export_state SET lease_owner = ?, lease_until = ? "
+                "WHERE guild_id = ? AND (lease_owner IS NULL OR lease_owner = ? OR lease_until < ?)",
+                (self.owner, now + ttl, guild_id, self.owner, now),
+            ),
+        ])
+        return cursor.rowcount == 1
+
+    def release_export_lease(self, guild_id: int):
+        self._write([(
+            "UPDATE export_state SET lease_owner = NULL, lease_until = 0 WHERE guild_id = ? AND lease_owner = ?",
+            (guild_id, self.owner),
+        )])
+
+    def get_export_message_id(self, guild_id: int):
+        rows = self._read("SELECT message_id FROM export_state WHERE guild_id = ?", (guild_id,))
+        return rows[0][0] if rows else None
+
+    def set_export_message_id(self, guild_id: int, message_id: int):
+        self._write([
+            ("INSERT OR IGNORE INTO export_state (guild_id) VALUES (?)", (guild_id,)),
+            ("UPDATE export_state SET message_id = ? WHERE guild_id = ?", (message_id, guild_id)),
+        ])
+
+    def import_local_state(self, source: str, state: dict) -> bool:
+        """Importa una volta sola lo stato del deployment a processo singolo (vedi import_local_state).
+
+        Non sovrascrive niente di già presente nel DB. Ritorna False se l'import era già stato fatto.
+        """
+        now = time.time()
+        with self._lock:
+            self._conn.execute("BEGIN IMMEDIATE")
+            try:
+                if self._conn.execute("SELECT 1 FROM store_info WHERE key = 'imported_from'").fetchone():
+                    self._conn.execute("ROLLBACK")
+                    return False
+                statements = [
+                    ("INSERT INTO store_info (key, value) VALUES ('imported_from', ?)", (source,)),
+                ]
+                for gid, cfg in state["guild_configs"].items():
+                    statements.append((
+                        "INSERT OR IGNORE INTO guild_config (guild_id, config, updated_at) VALUES (?, ?, ?)",
+                        (gid, json.dumps(cfg, ensure_ascii=False), now),
+                    ))
+                for gid, next_id in state["report_counters"].items():
+                    statements.append((
+                        "INSERT INTO report_counters (guild_id, next_id) VALUES (?, ?) "
+                        "ON CONFLICT(guild_id) DO UPDATE SET next_id = MAX(next_id, excluded.next_id)",
+                        (gid, next_id),
+                    ))
+                for gid, reports in state["classified_reports"].items():
+                    for rid, record in reports.items():
+                        statements.append((
+                            "INSERT OR IGNORE INTO reports (guild_id, report_id, record, updated_at) VALUES (?, ?, ?, ?)",
+                            (gid, rid, json.dumps(record, ensure_ascii=False), now),
+                        ))
+                for mid, meta in state["report_meta"].items():
+                    statements.append((
+                        "INSERT OR IGNORE INTO report_meta (message_id, guild_id, meta, updated_at) VALUES (?, ?, ?, ?)",
+                        (mid, meta.get("guild_id") or 0, json.dumps(meta, ensure_ascii=False), now),
+                    ))
+                for gid, buckets in state["crash_buckets"].items():
+                    for signature, bucket in buckets.items():
+                        statements.append((
+                            "INSERT OR IGNORE INTO crash_buckets (guild_id, signature, bucket, updated_at) "
+                            "VALUES (?, ?, ?, ?)",
+                            (gid, signature, json.dumps(bucket, ensure_ascii=False), now),
+                        ))
+                for gid, message_id in state["export_message_ids"].items():
+                    statements.append(("INSERT OR IGNORE INTO export_state (guild_id) VALUES (?)", (gid,)))
+                    statements.append((
+                        "UPDATE export_state SET message_id = ? WHERE guild_id = ? AND message_id IS NULL",
+                        (message_id, gid),
+                    ))
+                for sql, params in statements:
+                    self._conn.execute(sql, params)
+                self._conn.execute("COMMIT")
+                return True
+            except Exception:
+                self._conn.execute("ROLLBACK")
+                raise
+
+    def write_shard_metrics(self, rows: list):
+        self._write([(
+            "INSERT OR REPLACE INTO shard_metrics "
+            "(shard_id, owner, guilds, latency_ms, commands, reports, priority_changes, events_per_min, updated_at) "
+            "VALUES (?, ?, ?, ?, ?, ?, ?, ?, ?)",
+            (row["shard_id"], self.owner, row["guilds"], row["latency_ms"], row["commands"], row["reports"],
+             row["priority_changes"], row["events_per_min"], time.time()),
+        ) for row in rows])
+
+    def read_shard_metrics(self) -> list:
+        cols = ("shard_id", "owner", "guilds", "latency_ms", "commands", "reports",
+                "priority_changes", "events_per_min", "updated_at")
+        rows = self._read(f"SELECT {', '.join(cols)} FROM shard_metrics ORDER BY shard_id")
+        return [dict(zip(cols, row)) for row in rows]
+
+
+_shared_store: SharedStore = None
+
+
+def import_local_state(store: SharedStore):
+    """Alla prima attivazione dello stato condiviso porta nel DB lo stato di DATA_DIR.
+
+    Da chiamare dopo load_state_snapshot (snapshot + log) con DATA_DIR del deployment a processo
+    singolo: senza, i processi shard ripartirebbero da ID 1 e perderebbero report, metadati dei
+    bottoni, export e le config di !setup (guild_config.json).
+    """
+    try:
+        with open(GUILD_CONFIG_FILE, encoding="utf-8") as f:
+            guild_configs = {int(gid): cfg for gid, cfg in json.load(f).items()}
+    except FileNotFoundError:
+        guild_configs = {}
+    state = {
+        "guild_configs": guild_configs,
+        "report_counters": dict(_report_counters),
+        "classified_reports": classified_reports,
+        "report_meta": _report_meta,
+        "crash_buckets": crash_buckets,
+        "export_message_ids": dict(export_message_ids),
+    }
+    if store.import_local_state(os.path.abspath(DATA_DIR), state):
+        logger.info(
+            f"📥 Stato locale importato in {store.path}: {_total_reports()} report, "
+            f"{len(_report_meta)} messaggi report, {len(guild_configs)} config server"
+        )
+
+
+def load_shared_state():
+    """Allinea la cache locale allo stato condiviso (dopo lo snapshot locale: il DB vince)."""
+    if not _shared_store:
+        return
+    for gid, reports in _shared_store.load_reports().items():
+        classified_reports.setdefault(gid, {}).update(reports)
+    for gid, next_id in _shared_store.load_report_counters().items():
+        _report_counters[gid] = max(_report_counters.get(gid, 1), next_id)
+    for gid, buckets in _shared_store.load_crash_buckets().items():
+        crash_buckets.setdefault(gid, {}).update(buckets)
+    logger.info(f"🗄️ Stato condiviso caricato da {_shared_store.path} ({len(classified_reports)} server)")
+
+
+_shard_metrics_last = {}      # shard_id -> (monotonic, totale eventi) dell'ultimo campione
+_guild_config_version: float = 0.0
+
+
+@tasks.loop(seconds=SHARED_SYNC_INTERVAL)
+async def shared_state_sync():
+    """Calcola il throughput per shard e, con lo stato condiviso, pubblica metriche e rilegge le config."""
+    global _guild_config_version
+    try:
+        now = time.monotonic()
+        latencies = dict(getattr(bot, "latencies", None) or [(0, bot.latency)])
+        guild_counts = {}
+        for guild in bot.guilds:
+            guild_counts[guild.shard_id or 0] = guild_counts.get(guild.shard_id or 0, 0) + 1
+
+        rows = []
+        for shard_id in sorted(set(latencies) | set(_shard_metrics)):
+            counters = _shard_metrics.get(shard_id, {"commands": 0, "reports": 0, "priority_changes": 0})
+            total = sum(counters.values())
+            last_ts, last_total = _shard_metrics_last.get(shard_id, (now, total))
+            elapsed = now - last_ts
+            events_per_min = (total - last_total) * 60 / elapsed if elapsed > 0 else 0.0
+            _shard_metrics_last[shard_id] = (now, total)
+            latency = latencies.get(shard_id)
+            rows.append({
+                "shard_id": shard_id,
+                "guilds": guild_counts.get(shard_id, 0),
+                "latency_ms": round(latency * 1000, 1) if latency and latency != float("inf") else None,
+                "events_per_min": round(events_per_min, 2),
+                **counters,
+            })
+        _shard_rates.clear()
+        _shard_rates.update({row["shard_id"]: row for row in rows})
+
+        if _shared_store:
+            await asyncio.to_thread(_shared_store.write_shard_metrics, rows)
+            version = await asyncio.to_thread(_shared_store.guild_config_version)
+            if version > _guild_config_version:
+                # config modificata (anche da un altro processo): ricarica e invalida la cache
+                configs = await asyncio.to_thread(_shared_store.load_guild_configs)
+                _guild_config_store.clear()
+                _guild_config_store.update(configs)
+                invalidate_guild_config()
+                _guild_config_version = version
+    except Exception as e:
+        logger.error(f"❌ Errore nella sincronizzazione stato condiviso: {e}")
+
+
+@shared_state_sync.before_loop
+async def before_shared_state_sync():
+    await bot.wait_until_ready()
+
+
+async def read_shard_metrics() -> list:
+    """Metriche di tutti gli shard: dal DB condiviso se presente, altrimenti solo locali."""
+    if _shared_store:
+        return await asyncio.to_thread(_shared_store.read_shard_metrics)
+    return [dict(row, owner="local") for row in _shard_rates.values()]
+
+
 # =========================
 #        DISCORD BOT
 # =========================
@@ -79,42 +784,84 @@ intents = discord.Intents.default()
 intents.message_content = True
 intents.members = True  # abilita "Server Members Intent" nel Developer Portal
 
-bot = commands.Bot(command_prefix="!", intents=intents)
+# il client viene ricreato a ogni tentativo di connessione (vedi create_bot)
+bot: commands.Bot = None
+
+
+def create_bot() -> commands.Bot:
+    """Crea un client nuovo con eventi e comandi registrati (AutoShardedBot se richiesto)."""
+    if SHARD_COUNT or SHARD_IDS or AUTO_SHARD:
+        new_bot = commands.AutoShardedBot(
+            command_prefix="!", intents=intents, shard_count=SHARD_COUNT, shard_ids=SHARD_IDS
+        )
+    else:
+        new_bot = commands.Bot(command_prefix="!", intents=intents)
+    for handler in (on_ready, on_disconnect, on_resumed, on_message, on_command_completion):
+        new_bot.event(handler)
+    for command in (status, bug, crash, todo, setup):
+        new_bot.add_command(command)
+    # il view store muore col client: i bottoni priorità dei report vanno registrati su ogni client nuovo
+    new_bot.add_view(PriorityOnReportView())
+    return new_bot
+
+
+def _mark_outage_start():
+    global _outage_started
+    if _outage_started is None:
+        _outage_started = time.monotonic()
+
+
+def _mark_recovered():
+    """Registra il tempo di recupero se c'era un disservizio in corso."""
+    global _outage_started, _consecutive_failures
+    _consecutive_failures = 0
+    if _outage_started is not None:
+        elapsed = time.monotonic() - _outage_started
+        recovery_times.append(elapsed)
+        _outage_started = None
+        logger.info(f"⏱️ Connessione recuperata in {elapsed:.1f}s")
 
 
 # =========================
 #         EVENTS
 # =========================
-@bot.event
 async def on_ready():
-    global last_heartbeat, bot_start_time
+    global last_heartbeat, bot_start_time, gateway_connected
     bot_start_time = datetime.now()
     last_heartbeat = datetime.now()
+    gateway_connected = True
+    _mark_recovered()
+    await _seed_legacy_guild()
 
     logger.info(f"🟢 Bot online: {bot.user.name} (ID: {bot.user.id})")
-    logger.info(f"🔗 Connesso a {len(bot.guilds)} server")
+    shard_ids = getattr(bot, "shard_ids", None) or [bot.shard_id or 0]
+    logger.info(f"🔗 Connesso a {len(bot.guilds)} server (shard: {shard_ids} di {bot.shard_count or 1})")
     logger.info(f"⏱️ Avvio completato alle: {bot_start_time.strftime('%Y-%m-%d %H:%M:%S')}")
     print(f"We are ready to go!, {bot.user.name}")
 
     if not uptime_monitor.is_running():
         uptime_monitor.start()
 
-    # 👉 avvio ping orario canale report
-    if not channel_keepalive_pinger.is_running():
-        channel_keepalive_pinger.start()
+    if not shared_state_sync.is_running():
+        shared_state_sync.start()
+
+    if not blob_janitor.is_running():
+        blob_janitor.start()
 
 
-@bot.event
 async def on_disconnect():
-    global disconnection_count
+    global disconnection_count, gateway_connected
     disconnection_count += 1
+    gateway_connected = False
+    _mark_outage_start()
     logger.warning(f"🔴 Bot disconnesso! (Disconnessione #{disconnection_count})")
 
 
-@bot.event
 async def on_resumed():
-    global last_heartbeat
+    global last_heartbeat, gateway_connected
     last_heartbeat = datetime.now()
+    gateway_connected = True
+    _mark_recovered()
     logger.info(f"🟡 Bot riconnesso alle: {last_heartbeat.strftime('%Y-%m-%d %H:%M:%S')}")
 
 
@@ -139,6 +886,8 @@ async def uptime_monitor():
         if latency_ms > 5000:
             logger.warning(f"⚠️ Latenza alta rilevata: {latency_ms}ms")
 
+        prune_throttle_state()
+
     except Exception as e:
         logger.error(f"❌ Errore nel monitoraggio uptime: {e}")
 
@@ -149,34 +898,150 @@ async def before_uptime_monitor():
 
 
 # =========================
-#   HOURLY CHANNEL PING
+#      HEALTH CHECK
 # =========================
-@tasks.loop(minutes=60)
-async def channel_keepalive_pinger():
-    """Invia un messaggio ogni ora nel canale dei report."""
+async def loop_lag_probe(interval: float = 1.0):
+    """Misura il ritardo dell'event loop rispetto a uno sleep atteso."""
+    global loop_lag_ms
+    loop = asyncio.get_running_loop()
+    while True:
+        expected = loop.time() + interval
+        await asyncio.sleep(interval)
+        loop_lag_ms = max(0.0, (loop.time() - expected) * 1000)
+
+
+def _probe_store_writable() -> bool:
+    """Verifica che DATA_DIR sia scrivibile (gira in un thread)."""
     try:
-        ch = bot.get_channel(TARGET_CHANNEL_ID)
-        if not ch:
-            logger.error(f"❌ Canale target {TARGET_CHANNEL_ID} non trovato per keep-alive ping")
-            return
-        now = datetime.now().strftime("%Y-%m-%d %H:%M:%S")
-        await ch.send(f"⏰ Hourly ping — still alive ({now})")
-        logger.info("📣 Keep-alive ping inviato nel canale dei report.")
-    except discord.Forbidden:
-        logger.warning("⚠️ Permessi mancanti per scrivere nel canale keep-alive.")
+        os.makedirs(DATA_DIR, exist_ok=True)
+        probe = os.path.join(DATA_DIR, ".health_probe")
+        with open(probe, "w", encoding="utf-8") as f:
+            f.write(str(time.time()))
+        os.remove(probe)
+        return True
+    except OSError:
+        return False
+
+
+async def collect_health() -> dict:
+    """Raccoglie i controlli di readiness in un dizionario serializzabile."""
+    heartbeat_age = (datetime.now() - last_heartbeat).total_seconds()
+    store_writable = await asyncio.to_thread(_probe_store_writable)
+    checks = {
+        "gateway_connected": gateway_connected,
+        "heartbeat_fresh": heartbeat_age <= HEALTH_MAX_HEARTBEAT_AGE,
+        "loop_responsive": loop_lag_ms <= HEALTH_MAX_LOOP_LAG_MS,
+        "store_writable": store_writable,
+    }
+    return {
+        "ready": all(checks.values()),
+        "checks": checks,
+        "last_heartbeat_age_s": round(heartbeat_age, 1),
+        "loop_lag_ms": round(loop_lag_ms, 1),
+        "latency_ms": round(bot.latency * 1000, 2) if bot and bot.latency and bot.latency != float("inf") else None,
+        "uptime_s": round((datetime.now() - bot_start_time).total_seconds(), 1),
+    }
+
+
+async def _handle_health_request(reader: asyncio.StreamReader, writer: asyncio.StreamWriter):
+    """Server HTTP minimale: GET /healthz (liveness) e GET /readyz (readiness)."""
+    try:
+        request_line = await asyncio.wait_for(reader.readline(), timeout=5)
+        # scarta gli header
+        while True:
+            line = await asyncio.wait_for(reader.readline(), timeout=5)
+            if line in (b"\r\n", b"\n", b""):
+                break
+
+        parts = request_line.decode("latin-1").split()
+        path = parts[1] if len(parts) >= 2 else ""
+
+        if path == "/healthz":
+            # se rispondiamo, il loop gira: liveness = loop non bloccato
+            alive = loop_lag_ms <= HEALTH_MAX_LOOP_LAG_MS
+            status_code = 200 if alive else 503
+            body = {"alive": alive, "loop_lag_ms": round(loop_lag_ms, 1)}
+        elif path == "/readyz":
+            body = await collect_health()
+            status_code = 200 if body["ready"] else 503
+        else:
+            status_code, body = 404, {"error": "not found"}
+
+        payload = json.dumps(body).encode("utf-8")
+        reason = {200: "OK", 404: "Not Found", 503: "Service Unavailable"}[status_code]
+        writer.write(
+            f"HTTP/1.1 {status_code} {reason}\r\n"
+            f"Content-Type: application/json\r\n"
+            f"Content-Length: {len(payload)}\r\n"
+            f"Connection: close\r\n\r\n".encode("latin-1")
+            + payload
+        )
+        await writer.drain()
     except Exception as e:
-        logger.error(f"❌ Errore nel keep-alive ping: {e}")
+        logger.debug(f"Richiesta health non valida: {e}")
+    finally:
+        writer.close()
 
 
-@channel_keepalive_pinger.before_loop
-async def before_channel_keepalive_pinger():
-    await bot.wait_until_ready()
+async def start_health_server():
+    try:
+        server = await asyncio.start_server(_handle_health_request, HEALTH_HOST, HEALTH_PORT)
+        logger.info(f"🩺 Health endpoint in ascolto su http://{HEALTH_HOST}:{HEALTH_PORT} (/healthz, /readyz)")
+        return server
+    except OSError as e:
+        logger.error(f"❌ Impossibile avviare l'health endpoint su {HEALTH_HOST}:{HEALTH_PORT}: {e}")
+        return None
+
+
+_health_degraded: bool = False
+_pending_health_alert = None    # avviso non ancora consegnato (es. gateway giù): si riprova a ogni giro
+
+
+async def _deliver_health_alert():
+    global _pending_health_alert
+    ch = bot.get_channel(HEALTH_ALERT_CHANNEL_ID) if bot and bot.is_ready() else None
+    if not ch:
+        return
+    try:
+        await ch.send(_pending_health_alert)
+    except discord.Forbidden:
+        logger.warning("⚠️ Permessi mancanti per scrivere l'avviso di health nel canale report.")
+    _pending_health_alert = None
+
+
+async def health_watchdog(interval: float = 60.0):
+    """Avvisa nel canale dei report solo quando lo stato di salute peggiora.
+
+    Gira da main() e non dal client: deve continuare anche mentre il supervisor ricrea il client,
+    che è proprio il caso peggiore (gateway assente tra un tentativo e l'altro).
+    """
+    global _health_degraded, _pending_health_alert
+    while True:
+        await asyncio.sleep(interval)
+        try:
+            health = await collect_health()
+            failing = [name for name, ok in health["checks"].items() if not ok]
+
+            if failing and not _health_degraded:
+                _health_degraded = True
+                logger.warning(f"⚠️ Health degradato: {', '.join(failing)}")
+                if HEALTH_ALERT_PING:
+                    now = datetime.now().strftime("%Y-%m-%d %H:%M:%S")
+                    _pending_health_alert = f"⚠️ Bot health degraded ({now}): {', '.join(failing)}"
+            elif not failing and _health_degraded:
+                _health_degraded = False
+                logger.info("🟢 Health di nuovo OK")
+
+            if _pending_health_alert:
+                await _deliver_health_alert()
+        except Exception as e:
+            logger.error(f"❌ Errore nel controllo health: {e}")
 
 
 # =========================
 #        COMMANDS
 # =========================
-@bot.command()
+@commands.command()
 async def status(ctx: commands.Context):
     """Mostra lo stato e le statistiche del bot."""
     try:
@@ -200,9 +1065,37 @@ async def status(ctx: commands.Context):
 
         embed.add_field(name="🌐 Server", value=f"{len(bot.guilds)}", inline=True)
 
+        last_recovery = f"{recovery_times[-1]:.1f}s" if recovery_times else "—"
         embed.add_field(
             name="📈 Statistiche",
-            value=f"Disconnessioni: {disconnection_count}\nRiconnessioni: {reconnection_attempts}",
+            value=(
+                f"Disconnessioni: {disconnection_count}\n"
+                f"Riconnessioni: {reconnection_attempts}\n"
+                f"Errori ultima ora: {len(_reconnect_failures)}/{RECONNECT_MAX_FAILURES}\n"
+                f"Ultimo recupero: {last_recovery}"
+            ),
+            inline=False,
+        )
+
+        shard_rows = await read_shard_metrics()
+        if shard_rows:
+            lines = [
+                f"#{row['shard_id']} ({row['owner']}): {row['guilds']} server, "
+                f"{row['events_per_min']:.1f} ev/min, {row['latency_ms'] if row['latency_ms'] is not None else '—'}ms"
+                for row in shard_rows
+            ]
+            total_rate = sum(row["events_per_min"] for row in shard_rows)
+            lines.append(f"Totale: {total_rate:.1f} ev/min su {len(shard_rows)} shard")
+            embed.add_field(name="🧩 Shard", value="\n".join(lines)[-1024:], inline=False)
+
+        embed.add_field(
+            name="🚦 Throttling",
+            value=(
+                f"Flow ammessi: {throttle_stats['allowed']}\n"
+                f"Limitati: utente {throttle_stats['user']} · canale {throttle_stats['channel']} · "
+                f"server {throttle_stats['guild']}\n"
+                f"Avvisi inviati: {throttle_stats['notices']}"
+            ),
             inline=False,
         )
 
@@ -213,42 +1106,241 @@ async def status(ctx: commands.Context):
         await ctx.reply("❌ Errore nel recuperare le statistiche del bot.")
 
 
-@bot.command()
+@commands.command()
 async def bug(ctx: commands.Context):
     await ctx.reply("Please, can you be more precise? Please select the category")
 
 
-@bot.command()
+@commands.command()
 async def crash(ctx: commands.Context):
     await ctx.reply("Oh no, that's terrible! Please, can you be more precise? Please select the category")
 
 
-@bot.command()
+@commands.command()
 async def todo(ctx: commands.Context):
     """Avvia il flow per creare un TODO (descrizione max 150, categoria/sottocategoria)."""
     await ctx.reply("📝 Let's add a TODO. Please select the category.")
 
 
+def admin_only(func):
+    """Solo in un server e con il permesso *Gestisci server*.
+
+    Va messo su ogni sottocomando: con invoke_without_command=True i check del gruppo
+    non vengono eseguiti quando si invoca un sottocomando.
+    """
+    return commands.guild_only()(commands.has_guild_permissions(manage_guild=True)(func))
+
+
+@commands.group(invoke_without_command=True)
+@admin_only
+async def setup(ctx: commands.Context):
+    """Mostra la config del server (canali, tassonomia, parole moderate)."""
+    cfg = get_guild_config(ctx.guild.id)
+
+    def fmt(channel_id):
+        return f"<#{channel_id}>" if channel_id else "—"
+
+    taxonomy = "\n".join(f"**{cat}**: {', '.join(subs)}" for cat, subs in cfg["taxonomy"].items())
+    embed = discord.Embed(title=f"⚙️ Config {ctx.guild.name}", color=discord.Color.blurple())
+    embed.add_field(name="Report", value=fmt(cfg["target_channel_id"]), inline=True)
+    embed.add_field(name="Comandi", value=fmt(cfg["allowed_channel_id"]), inline=True)
+    embed.add_field(name="Export", value=fmt(cfg["export_channel_id"]), inline=True)
+    embed.add_field(name="Tassonomia", value=taxonomy or "—", inline=False)
+    embed.add_field(name="Parole moderate", value=", ".join(cfg["banned_words"]) or "—", inline=False)
+    embed.set_footer(text="!setup target|allowed|export #canale|none · !setup category NOME sub1, sub2 · !setup words a, b")
+    await ctx.reply(embed=embed, mention_author=False)
+
+
+@setup.command(name="target")
+@admin_only
+async def setup_target(ctx: commands.Context, channel: discord.TextChannel = None):
+    await update_guild_config(ctx.guild.id, target_channel_id=channel.id if channel else None)
+    await ctx.reply(f"✅ Canale report: {channel.mention if channel else '—'}", mention_author=False)
+
+
+@setup.command(name="allowed")
+@admin_only
+async def setup_allowed(ctx: commands.Context, channel: discord.TextChannel = None):
+    await update_guild_config(ctx.guild.id, allowed_channel_id=channel.id if channel else None)
+    await ctx.reply(f"✅ Canale comandi: {channel.mention if channel else 'tutti'}", mention_author=False)
+
+
+@setup.command(name="export")
+@admin_only
+async def setup_export(ctx: commands.Context, channel: discord.TextChannel = None):
+    await update_guild_config(ctx.guild.id, export_channel_id=channel.id if channel else None)
+    await ctx.reply(f"✅ Canale export: {channel.mention if channel else '—'}", mention_author=False)
+
+
+@setup.command(name="category")
+@admin_only
+async def setup_category(ctx: commands.Context, name: str, *, subcategories: str = ""):
+    """Aggiunge/sostituisce una categoria; senza sottocategorie la rimuove."""
+    taxonomy = dict(get_guild_config(ctx.guild.id)["taxonomy"])
+    category = name.upper()
+    subs = [s.strip() for s in subcategories.split(",") if s.strip()]
+    too_long = [label for label in (category, *subs) if len(label) > MAX_BUTTON_LABEL]
+    if too_long:
+        return await ctx.reply(f"❌ Nomi oltre {MAX_BUTTON_LABEL} caratteri: {', '.join(too_long)[:1500]}")
+    if subs:
+        if len(subs) > MAX_TAXONOMY_BUTTONS or (category not in taxonomy and len(taxonomy) >= MAX_TAXONOMY_BUTTONS):
+            return await ctx.reply(f"❌ Massimo {MAX_TAXONOMY_BUTTONS} categorie e sottocategorie.")
+        taxonomy[category] = subs
+    elif taxonomy.pop(category, None) is None:
+        return await ctx.reply(f"❌ Categoria {category} non trovata.")
+    if not taxonomy:
+        return await ctx.reply("❌ Serve almeno una categoria.")
+    await update_guild_config(ctx.guild.id, taxonomy=taxonomy)
+    await ctx.reply(f"✅ Categoria {category}: {', '.join(subs) if subs else 'rimossa'}", mention_author=False)
+
+
+@setup.command(name="words")
+@admin_only
+async def setup_words(ctx: commands.Context, *, words: str = ""):
+    """Sostituisce l'elenco di parole moderate (separate da virgola)."""
+    banned = [w.strip().lower() for w in words.split(",") if w.strip()]
+    await update_guild_config(ctx.guild.id, banned_words=banned)
+    await ctx.reply(f"✅ Parole moderate: {', '.join(banned) or '—'}", mention_author=False)
+
+
+async def setup_error(ctx: commands.Context, error: commands.CommandError):
+    if isinstance(error, commands.MissingPermissions):
+        await ctx.reply("❌ Serve il permesso *Gestisci server* per configurare il bot.")
+    elif isinstance(error, commands.NoPrivateMessage):
+        await ctx.reply("❌ Il comando funziona solo in un server.")
+    elif isinstance(error, (commands.BadArgument, commands.MissingRequiredArgument)):
+        await ctx.reply(f"❌ Argomenti non validi: {error}")
+    else:
+        logger.error(f"Errore comando setup: {error}")
+
+
+# @setup.error non copre i sottocomandi: stesso handler su ciascuno
+for _setup_command in (setup, setup_target, setup_allowed, setup_export, setup_category, setup_words):
+    _setup_command.error(setup_error)
+
+
+# =========================
+#       THROTTLING
+# =========================
+FLOW_COMMANDS = frozenset({"bug", "crash", "todo"})
+
+# _throttle_buckets[(scope, id)] = [token disponibili, time.monotonic() ultimo aggiornamento]
+_throttle_buckets = {}
+_throttle_notices = {}   # user_id -> time.monotonic() dell'ultimo avviso di throttling
+_gate_notices = {}       # user_id -> time.monotonic() dell'ultimo avviso riavvio/canale sbagliato
+throttle_stats = {"allowed": 0, "user": 0, "channel": 0, "guild": 0, "notices": 0}
+
+
+def _refill(key, capacity: int, rate: float, now: float) -> list:
+    bucket = _throttle_buckets.get(key)
+    if bucket is None:
+        bucket = _throttle_buckets[key] = [float(capacity), now]
+    else:
+        bucket[0] = min(capacity, bucket[0] + (now - bucket[1]) * rate)
+        bucket[1] = now
+    return bucket
+
+
+def take_flow_token(guild_id: int, channel_id: int, user_id: int):
+    """Consuma un token per utente, canale e server. Ritorna None se ammesso, altrimenti (scope, attesa_s)."""
+    now = time.monotonic()
+    limits = (
+        ("user", user_id, THROTTLE_USER),
+        ("channel", channel_id, THROTTLE_CHANNEL),
+        ("guild", guild_id, THROTTLE_GUILD),
+    )
+    buckets = []
+    for scope, key_id, (capacity, rate) in limits:
+        bucket = _refill((scope, key_id), capacity, rate, now)
+        if bucket[0] < 1:
+            throttle_stats[scope] += 1
+            return scope, (1 - bucket[0]) / rate
+        buckets.append(bucket)
+    # si consuma solo se tutti e tre hanno un token
+    for bucket in buckets:
+        bucket[0] -= 1
+    throttle_stats["allowed"] += 1
+    return None
+
+
+def _notice_cooldown_ok(notices: dict, user_id: int) -> bool:
+    """Un solo avviso ogni THROTTLE_NOTICE_COOLDOWN per utente: gli avvisi non diventano spam."""
+    now = time.monotonic()
+    last = notices.get(user_id)
+    if last is not None and now - last < THROTTLE_NOTICE_COOLDOWN:
+        return False
+    notices[user_id] = now
+    return True
+
+
+def should_notify_throttled(user_id: int) -> bool:
+    """Avviso di flow limitato (conteggiato in !status)."""
+    if not _notice_cooldown_ok(_throttle_notices, user_id):
+        return False
+    throttle_stats["notices"] += 1
+    return True
+
+
+def should_notify_gate(user_id: int) -> bool:
+    """Avviso di riavvio o canale sbagliato: cooldown separato, non consuma quello del throttling."""
+    return _notice_cooldown_ok(_gate_notices, user_id)
+
+
+def prune_throttle_state():
+    """Scarta i bucket già pieni e gli avvisi scaduti (equivalenti a non averli)."""
+    now = time.monotonic()
+    capacities = {"user": THROTTLE_USER, "channel": THROTTLE_CHANNEL, "guild": THROTTLE_GUILD}
+    for key, (tokens, updated) in list(_throttle_buckets.items()):
+        capacity, rate = capacities[key[0]]
+        if tokens + (now - updated) * rate >= capacity:
+            del _throttle_buckets[key]
+    for notices in (_throttle_notices, _gate_notices):
+        for user_id, last in list(notices.items()):
+            if now - last >= THROTTLE_NOTICE_COOLDOWN:
+                del notices[user_id]
+
+
 # =========================
 #     MESSAGE GATE / MOD
 # =========================
-@bot.event
 async def on_message(message: discord.Message):
     if message.author == bot.user:
         return
 
-    # limita i comandi (!) a un solo canale
-    if message.content.startswith("!") and ALLOWED_CHANNEL_ID and message.channel.id != ALLOWED_CHANNEL_ID:
+    # in spegnimento: niente nuovi flow
+    if _shutting_down and message.content.startswith("!"):
+        if not should_notify_gate(message.author.id):
+            return
         try:
-            await message.channel.send(
-                f"❌ {message.author.mention} I comandi del bot sono consentiti solo in <#{ALLOWED_CHANNEL_ID}>"
-            )
+            await message.channel.send(f"🔄 {message.author.mention} Bot in riavvio, riprova tra qualche secondo.")
         except Exception:
             pass
         return
 
-    # moderazione semplice
-    if "shit" in message.content.lower():
+    if message.guild is None:
+        return
+
+    cfg = get_guild_config(message.guild.id)
+    is_command = message.content.startswith("!")
+
+    # limita i comandi (!) al canale configurato per il server
+    allowed_channel_id = cfg["allowed_channel_id"]
+    if is_command and allowed_channel_id and message.channel.id != allowed_channel_id:
+        # !setup resta sempre raggiungibile, altrimenti un canale sbagliato non si corregge più
+        if not message.content.startswith("!setup"):
+            if not should_notify_gate(message.author.id):
+                return
+            try:
+                await message.channel.send(
+                    f"❌ {message.author.mention} I comandi del bot sono consentiti solo in <#{allowed_channel_id}>"
+                )
+            except Exception:
+                pass
+            return
+
+    # moderazione semplice (prima del throttling: anche i comandi limitati vanno moderati)
+    content_lower = message.content.lower()
+    if any(word in content_lower for word in cfg["banned_words"]):
         try:
             await message.delete()
             await message.channel.send(f"{message.author.mention} don't use that word")
@@ -262,14 +1354,343 @@ async def on_message(message: discord.Message):
         except Exception as e:
             logger.error(f"❌ Errore nella moderazione: {e}")
 
+    # throttling dei flow prima di qualsiasi allocazione o chiamata in uscita
+    # (gli avvisi sopra sono già limitati da should_notify_gate)
+    if is_command:
+        command_name = message.content[1:].split(maxsplit=1)[0].lower() if len(message.content) > 1 else ""
+        if command_name in FLOW_COMMANDS:
+            throttled = take_flow_token(message.guild.id, message.channel.id, message.author.id)
+            if throttled:
+                scope, wait_s = throttled
+                logger.info(f"🚦 !{command_name} di {message.author} limitato ({scope}, {wait_s:.0f}s)")
+                if should_notify_throttled(message.author.id):
+                    try:
+                        await message.reply(
+                            f"⏳ Too many reports right now, please try again in {max(1, round(wait_s))}s.",
+                            mention_author=False,
+                            delete_after=15,
+                        )
+                    except Exception:
+                        pass
+                return
+
     await bot.process_commands(message)
 
 
+# =========================
+#   ATTACHMENTS / BLOBS
+# =========================
+_http_session: aiohttp.ClientSession = None
+
+
+def _get_http_session() -> aiohttp.ClientSession:
+    global _http_session
+    if _http_session is None or _http_session.closed:
+        _http_session = aiohttp.ClientSession(timeout=aiohttp.ClientTimeout(total=120))
+    return _http_session
+
+
+def blob_path(digest: str) -> str:
+    return os.path.join(BLOB_DIR, digest[:2], digest)
+
+
+def _open_part_file() -> tuple:
+    tmp_dir = os.path.join(BLOB_DIR, "tmp")
+    os.makedirs(tmp_dir, exist_ok=True)
+    path = os.path.join(tmp_dir, f"{uuid.uuid4().hex}.part")
+    return path, open(path, "wb")
+
+
+def _commit_blob(tmp_path: str, digest: str) -> bool:
+    """Sposta il file scaricato al suo indirizzo. Ritorna False se il contenuto c'era già."""
+    final_path = blob_path(digest)
+    if os.path.exists(final_path):
+        os.remove(tmp_path)
+        os.utime(final_path)  # conta come uso recente per l'eviction
+        return False
+    os.makedirs(os.path.dirname(final_path), exist_ok=True)
+    os.replace(tmp_path, final_path)
+    return True
+
+
+def _discard_part(tmp_path: str):
+    try:
+        os.remove(tmp_path)
+    except FileNotFoundError:
+        pass
+
+
+async def store_attachment(attachment: discord.Attachment):
+    """Scarica un allegato a blocchi calcolando lo SHA-256 e lo salva nello store. None se rifiutato."""
+    if attachment.size > ATTACHMENT_MAX_BYTES:
+        logger.info(f"📎 Allegato {attachment.filename} rifiutato: {attachment.size} byte oltre il limite")
+        return None
+
+    digest = hashlib.sha256()
+    size = 0
+    tmp_path, f = await asyncio.to_thread(_open_part_file)
+    try:
+        async with _get_http_session().get(attachment.url) as resp:
+            resp.raise_for_status()
+            async for chunk in resp.content.iter_chunked(ATTACHMENT_CHUNK_SIZE):
+                size += len(chunk)
+                if size > ATTACHMENT_MAX_BYTES:
+                    raise ValueError(f"oltre {ATTACHMENT_MAX_BYTES} byte")
+                digest.update(chunk)
+                await asyncio.to_thread(f.write, chunk)
+        await asyncio.to_thread(f.close)
+        sha256 = digest.hexdigest()
+        is_new = await asyncio.to_thread(_commit_blob, tmp_path, sha256)
+    except Exception as e:
+        f.close()
+        await asyncio.to_thread(_discard_part, tmp_path)
+        logger.warning(f"⚠️ Download allegato {attachment.filename} fallito: {e}")
+        return None
+
+    logger.info(f"📎 Allegato {attachment.filename} ({size} byte) {'salvato' if is_new else 'già presente'}: {sha256[:12]}")
+    return {
+        "sha256": sha256,
+        "filename": attachment.filename,
+        "size": size,
+        "content_type": attachment.content_type,
+    }
+
+
+async def store_attachments(attachments: list) -> list:
+    results = await asyncio.gather(*(store_attachment(a) for a in attachments[:ATTACHMENTS_PER_REPORT]))
+    return [r for r in results if r]
+
+
+def format_attachments(attachments: list) -> str:
+    return ", ".join(f"{a['filename']} (`{a['sha256'][:12]}`, {a['size'] // 1024 or 1} KB)" for a in attachments)
+
+
+def evict_blobs() -> tuple:
+    """Elimina i blob inutilizzati da più di BLOB_MAX_AGE, poi i meno recenti oltre BLOB_STORE_MAX_BYTES."""
+    now = time.time()
+    blobs = []
+    removed = freed = 0
+    for root, _dirs, files in os.walk(BLOB_DIR):
+        for name in files:
+            path = os.path.join(root, name)
+            try:
+                st = os.stat(path)
+            except FileNotFoundError:
+                continue
+            is_part = name.endswith(".part")
+            # .part orfani (download interrotti) o blob vecchi
+            if (is_part and now - st.st_mtime > 3600) or (not is_part and now - st.st_mtime > BLOB_MAX_AGE):
+                os.remove(path)
+                removed += 1
+                freed += st.st_size
+            elif not is_part:
+                blobs.append((st.st_mtime, st.st_size, path))
+
+    total = sum(size for _, size, _ in blobs)
+    for _mtime, size, path in sorted(blobs):
+        if total <= BLOB_STORE_MAX_BYTES:
+            break
+        os.remove(path)
+        total -= size
+        removed += 1
+        freed += size
+    return removed, freed, total
+
+
+@tasks.loop(hours=1)
+async def blob_janitor():
+    try:
+        removed, freed, total = await asyncio.to_thread(evict_blobs)
+        if removed:
+            logger.info(f"🧹 Blob eliminati: {removed} ({freed // 1024} KB), store a {total // 1024} KB")
+    except Exception as e:
+        logger.error(f"❌ Errore nella pulizia dei blob: {e}")
+
+
+# =========================
+#    CRASH SIGNATURES
+# =========================
+# Analisi dei log nel pool dedicato: lavoro limitato a CRASH_PARSE_MAX_LINES righe per file.
+_crash_executor = ThreadPoolExecutor(max_workers=2, thread_name_prefix="crashsig")
+
+_EXCEPTION_PATTERNS = [
+    # Python / Java / C#: "ValueError: ...", "java.lang.NullPointerException: ..."
+    re.compile(r"^(?:Exception in thread \"[^\"]*\"\s+|Unhandled exception\.?\s+|Caused by:\s+)?"
+               r"((?:[A-Za-z_][\w$]*\.)*[A-Za-z_][\w$]*(?:Error|Exception|Fault))\b"),
+    # Windows: "Exception code: 0xC0000005", "EXCEPTION_ACCESS_VIOLATION"
+    re.compile(r"\b(EXCEPTION_[A-Z_]+|Exception code:?\s*0x[0-9A-Fa-f]+)"),
+    # POSIX
+    re.compile(r"\b(SIG(?:SEGV|ABRT|BUS|FPE|ILL)|Segmentation fault)\b"),
+]
+_FRAME_PATTERNS = [
+    re.compile(r'File "(?:.*[\\/])?([^\\/"]+)", line \d+, in (\S+)'),          # Python
+    re.compile(r"^\s*at\s+([\w$.<>]+)\s*\("),                                 # Java / C#
+    re.compile(r"([\w.-]+\.(?:dll|exe|so|dylib))!([\w:<>~$@?]+)"),             # WinDbg module!func
+    re.compile(r"#\d+\s+(?:0x[0-9a-fA-F]+\s+in\s+)?([\w:<>~$]+)\s*\("),         # gdb
+]
+_NOISE = re.compile(r"0x[0-9a-fA-F]+|\b\d+\b")
+
+
+def _normalize_frame(match: re.Match) -> str:
+    frame = "!".join(g for g in match.groups() if g)
+    # indirizzi, offset e numeri di riga cambiano tra build: fuori dalla firma
+    return _NOISE.sub("", frame).rstrip("+")
+
+
+def _match_first(patterns: list, line: str):
+    for pattern in patterns:
+        m = pattern.search(line)
+        if m:
+            return m
+    return None
+
+
+def extract_crash_signature(path: str):
+    """Firma normalizzata eccezione + stack di un log di crash (gira nel pool). None se non riconosciuto.
+
+    Il log è diviso in blocchi (un'eccezione con il suo stack); la firma usa l'ultimo blocco con frame,
+    così eccezioni loggate prima del crash o tracce concatenate non mescolano eccezione e frame.
+    """
+    blocks = []    # [{"exception": str|None, "frames": [str], "python": bool}]
+    with open(path, encoding="utf-8", errors="replace") as f:
+        for line_no, line in enumerate(f):
+            if line_no >= CRASH_PARSE_MAX_LINES:
+                break
+            line = line.strip()
+            if not line:
+                continue
+            current = blocks[-1] if blocks else None
+            if line.startswith("Traceback (most recent call last)"):
+                blocks.append({"exception": None, "frames": [], "python": True})
+                continue
+            m = _match_first(_FRAME_PATTERNS, line)
+            if m:
+                # Python chiude il blocco con l'eccezione: frame successivi aprono un blocco nuovo
+                if current is None or (current["python"] and current["exception"]):
+                    current = {"exception": None, "frames": [], "python": False}
+                    blocks.append(current)
+                current["frames"].append(_normalize_frame(m))
+                continue
+            m = _match_first(_EXCEPTION_PATTERNS, line)
+            if m:
+                exception = m.group(1).strip(" :")
+                if current and current["python"] and not current["exception"]:
+                    current["exception"] = exception        # riga finale del traceback Python
+                else:
+                    blocks.append({"exception": exception, "frames": [], "python": False})  # eccezione, poi stack
+
+    if not blocks:
+        return None
+    block = next((b for b in reversed(blocks) if b["frames"]), blocks[-1])
+    exception, frames = block["exception"], block["frames"]
+    # Python stampa il frame più interno per ultimo: lo mettiamo in cima come gli altri linguaggi
+    if block["python"]:
+        frames.reverse()
+    top = frames[:CRASH_SIGNATURE_FRAMES]
+    exception = exception or "UnknownCrash"
+    signature = hashlib.sha1("|".join([exception, *top]).encode("utf-8")).hexdigest()[:16]
+    return {
+        "signature": signature,
+        "title": f"{exception} @ {top[0]}" if top else exception,
+        "exception": exception,
+        "frames": top,
+    }
+
+
+def _is_text_log(attachment: dict) -> bool:
+    content_type = attachment.get("content_type") or ""
+    return content_type.startswith("text/") or attachment["filename"].lower().endswith(CRASH_LOG_EXTENSIONS)
+
+
+def merge_into_bucket(bucket, report_id: int, info: dict, version: str) -> dict:
+    """Bucket aggiornato con il report (bucket None: primo crash con questa firma)."""
+    if bucket is None:
+        bucket = {
+            "title": info["title"],
+            "count": 0,
+            "first_seen_version": version,
+            "first_seen_report": report_id,
+            "report_ids": [],
+        }
+    if report_id not in bucket["report_ids"]:
+        bucket["report_ids"].append(report_id)
+        bucket["count"] = len(bucket["report_ids"])
+    return bucket
+
+
+def _add_to_bucket(guild_id: int, report_id: int, info: dict, version: str) -> dict:
+    buckets = crash_buckets.setdefault(guild_id, {})
+    bucket = buckets[info["signature"]] = merge_into_bucket(buckets.get(info["signature"]), report_id, info, version)
+    return bucket
+
+
+async def bucket_crash_report(message: discord.Message, guild_id: int, report_id: int, version: str, attachments: list):
+    """Estrae la firma dai log allegati, aggiorna l'indice e la mostra sul messaggio del report."""
+    loop = asyncio.get_running_loop()
+    info = None
+    for attachment in filter(_is_text_log, attachments):
+        path = blob_path(attachment["sha256"])
+        started = time.perf_counter()
+        try:
+            info = await loop.run_in_executor(_crash_executor, extract_crash_signature, path)
+        except OSError as e:
+            logger.warning(f"⚠️ Log {attachment['filename']} non leggibile: {e}")
+            continue
+        logger.info(
+            f"🔎 Analisi crash {attachment['filename']} in {(time.perf_counter() - started) * 1000:.1f}ms: "
+            f"{info['signature'] if info else 'nessuna firma'}"
+        )
+        if info:
+            break
+    if not info:
+        return
+
+    if _shared_store:
+        # i bucket sono condivisi: lo stesso crash da processi diversi finisce nello stesso bucket
+        bucket = await asyncio.to_thread(_shared_store.add_to_crash_bucket, guild_id, report_id, info, version)
+        crash_buckets.setdefault(guild_id, {})[info["signature"]] = bucket
+    else:
+        bucket = _add_to_bucket(guild_id, report_id, info, version)
+    record_event(
+        "crash_bucketed",
+        guild_id=guild_id,
+        report_id=report_id,
+        message_id=message.id,
+        signature=info["signature"],
+        title=info["title"],
+        version=version,
+    )
+
+    meta = await get_report_meta(message.id)
+    if meta is not None:
+        meta["crash_signature"] = info["signature"]
+        if _shared_store:
+            await asyncio.to_thread(_shared_store.save_report_meta, message.id, dict(meta))
+    record = classified_reports.get(guild_id, {}).get(report_id)
+    if record is not None:
+        classified_reports[guild_id][report_id] = {**record, "crash_signature": info["signature"]}
+        if _shared_store:
+            await asyncio.to_thread(
+                _shared_store.upsert_report, guild_id, report_id, classified_reports[guild_id][report_id]
+            )
+
+    try:
+        await message.edit(
+            content=(
+                f"{message.content}\n**Crash bucket**: `{info['signature']}` {info['title']} "
+                f"({bucket['count']} report, first seen in {bucket['first_seen_version'] or '—'}, "
+                f"#{bucket['first_seen_report']})"
+            )
+        )
+    except Exception as e:
+        logger.warning(f"⚠️ Impossibile aggiornare il report #{report_id} con la firma del crash: {e}")
+
+
 # =========================
 #     REPORT / EXPORT
 # =========================
-async def save_classified_report(report_id: int, priority: str, meta: dict, report_data: str):
-    """Salva un report classificato nel database per export."""
+async def save_classified_report(report_id: int, priority: str, meta: dict, report_data: str, actor=None):
+    """Salva un report classificato nel database per export (e nel log eventi)."""
     global classified_reports
 
     lines = report_data.splitlines()
@@ -293,7 +1714,10 @@ async def save_classified_report(report_id: int, priority: str, meta: dict, repo
             if description == "—":
                 description = ""
 
-    classified_reports[report_id] = {
+    guild_id = meta.get("guild_id") or LEGACY_GUILD_ID
+    guild_reports = classified_reports.setdefault(guild_id, {})
+    previous = guild_reports.get(report_id, {}).get("priority")
+    record = {
         "priority": priority,
         "category": category,
         "subcategory": subcategory,
@@ -302,91 +1726,205 @@ async def save_classified_report(report_id: int, priority: str, meta: dict, repo
         "date": date,
         "description": description,
         "report_type": report_type,
+        "attachments": meta.get("attachments", []),
+        "crash_signature": meta.get("crash_signature"),
     }
+    guild_reports[report_id] = record
+    if _shared_store:
+        await asyncio.to_thread(_shared_store.upsert_report, guild_id, report_id, record)
+    count_shard_metric(guild_id, "priority_changes")
+
+    record_event(
+        "priority_changed",
+        guild_id=guild_id,
+        report_id=report_id,
+        priority=priority,
+        previous=previous,
+        actor_id=actor.id if actor else None,
+        actor=str(actor) if actor else None,
+        record=record,
+    )
+
+    logger.info(f"📝 Report #{report_id} (server {guild_id}) salvato con priorità {priority}")
+
+
+PRIORITY_ORDER = ["HIGH PRIORITY", "MEDIUM PRIORITY", "LOW PRIORITY", "ALREADY SOLVED"]
+
+
+def _snapshot_reports(guild_id: int) -> tuple:
+    """Copia immutabile dei report classificati del server, da passare al worker di export."""
+    reports = classified_reports.get(guild_id, {})
+    return tuple(sorted((rid, tuple(rep.items())) for rid, rep in reports.items()))
+
+
+async def _load_export_snapshot(guild_id: int) -> tuple:
+    """Con lo stato condiviso rilegge i report del server dal DB (possono arrivare da altri processi)."""
+    if _shared_store:
+        reports = await asyncio.to_thread(_shared_store.load_reports, guild_id)
+        classified_reports[guild_id] = reports.get(guild_id, {})
+    return _snapshot_reports(guild_id)
+
 
-    logger.info(f"📝 Report #{report_id} salvato con priorità {priority}")
+async def _acquire_export_lease(guild_id: int, attempts: int = 10) -> bool:
+    for _ in range(attempts):
+        if await asyncio.to_thread(_shared_store.acquire_export_lease, guild_id):
+            return True
+        await asyncio.sleep(1)
+    return False
 
 
-async def generate_export_file() -> str:
-    """Genera il testo export raggruppato per priorità > categoria > sottocategoria."""
-    if not classified_reports:
+def _render_export(snapshot: tuple, now_str: str, group_crashes: bool = True) -> str:
+    """Costruisce il testo export a partire da uno snapshot (gira nel worker, niente stato globale).
+
+    Con group_crashes i Crash classificati compaiono anche raggruppati per firma, in fondo.
+    """
+    if not snapshot:
         return "# REPORT CLASSIFICATI\n\nNessun report classificato al momento.\n"
 
-    priority_order = ["HIGH PRIORITY", "MEDIUM PRIORITY", "LOW PRIORITY", "ALREADY SOLVED"]
-    content = "# REPORTS\n"
-    content += f"Last update: {datetime.now().strftime('%Y-%m-%d %H:%M:%S')}\n"
-    content += f"Total reports: {len(classified_reports)}\n\n"
+    reports = [(rid, dict(items)) for rid, items in snapshot]
+    parts = [
+        "# REPORTS\n",
+        f"Last update: {now_str}\n",
+        f"Total reports: {len(reports)}\n\n",
+    ]
 
     # per priorità
-    for prio in priority_order:
-        prio_reports = {k: v for k, v in classified_reports.items() if v["priority"] == prio}
+    for prio in PRIORITY_ORDER:
+        prio_reports = [(rid, rep) for rid, rep in reports if rep["priority"] == prio]
         if not prio_reports:
             continue
 
-        content += f"## {prio} ({len(prio_reports)} report)\n\n"
+        parts.append(f"## {prio} ({len(prio_reports)} report)\n\n")
 
         # raggruppa per categoria/sottocategoria
         categories = {}
-        for report_id, report in prio_reports.items():
-            cat = report["category"]
-            sub = report["subcategory"]
-            categories.setdefault(cat, {}).setdefault(sub, []).append((report_id, report))
+        for report_id, report in prio_reports:
+            categories.setdefault(report["category"], {}).setdefault(report["subcategory"], []).append(
+                (report_id, report)
+            )
 
         for cat in sorted(categories.keys()):
-            content += f"### {cat}\n"
+            parts.append(f"### {cat}\n")
             for sub in sorted(categories[cat].keys()):
-                content += f"#### {sub}\n"
-                for report_id, report in sorted(categories[cat][sub]):
-                    content += (
+                parts.append(f"#### {sub}\n")
+                for report_id, report in sorted(categories[cat][sub], key=lambda item: item[0]):
+                    line = (
                         f"- **#{report_id}** [{report['report_type']}] "
                         f"**{report['user']}** | {report['version']} | {report['date']}"
                     )
                     if report["description"]:
-                        content += f" | {report['description']}"
-                    content += "\n"
-                content += "\n"
-            content += "\n"
+                        line += f" | {report['description']}"
+                    if report.get("attachments"):
+                        line += " | 📎 " + ", ".join(a["sha256"][:12] for a in report["attachments"])
+                    parts.append(line + "\n")
+                parts.append("\n")
+            parts.append("\n")
+
+        parts.append("---\n\n")
+
+    if group_crashes:
+        by_signature = {}
+        for report_id, report in reports:
+            if report["report_type"] == "Crash" and report.get("crash_signature"):
+                by_signature.setdefault(report["crash_signature"], []).append((report_id, report))
+        if by_signature:
+            parts.append(f"## CRASH BUCKETS ({len(by_signature)} signatures)\n\n")
+            for signature, items in sorted(by_signature.items(), key=lambda kv: (-len(kv[1]), kv[0])):
+                first_version = min(items, key=lambda item: item[0])[1]["version"]
+                parts.append(f"### `{signature}` ({len(items)} report, first seen in {first_version or '—'})\n")
+                for report_id, report in sorted(items, key=lambda item: item[0]):
+                    parts.append(
+                        f"- **#{report_id}** {report['priority']} | {report['category']}/{report['subcategory']} "
+                        f"| {report['version']} | {report['user']}\n"
+                    )
+                parts.append("\n")
+            parts.append("---\n\n")
+
+    return "".join(parts)
+
+
+def _render_export_bytes(snapshot: tuple, now_str: str, group_crashes: bool = True) -> tuple:
+    """Render + encoding UTF-8 nel worker. Ritorna (contenuto, durata_ms)."""
+    started = time.perf_counter()
+    data = _render_export(snapshot, now_str, group_crashes).encode("utf-8")
+    return data, (time.perf_counter() - started) * 1000
 
-        content += "---\n\n"
 
-    return content
+async def _render_in_worker(guild_id: int, snapshot: tuple, now_str: str, group_crashes: bool = True) -> bytes:
+    """Accoda un render nel worker annullando quello precedente del server se non ancora partito."""
+    previous = _export_render_futures.get(guild_id)
+    if previous and not previous.done():
+        previous.cancel()
 
+    loop = asyncio.get_running_loop()
+    future = loop.run_in_executor(_export_executor, _render_export_bytes, snapshot, now_str, group_crashes)
+    _export_render_futures[guild_id] = future
+    data, elapsed_ms = await future
+    logger.info(
+        f"🧮 Export server {guild_id} renderizzato in {elapsed_ms:.1f}ms "
+        f"({len(snapshot)} report, {len(data)} byte)"
+    )
+    return data
 
-async def update_export_message():
-    """Aggiorna (o crea) un messaggio pin con embed + file di export."""
-    global export_message_id
+
+async def generate_export_file(guild_id: int, now: datetime, group_crashes: bool = EXPORT_GROUP_CRASHES) -> tuple:
+    """Snapshot dei report del server + file di export renderizzato nel worker.
+
+    Raggruppato per priorità > categoria > sottocategoria e, con group_crashes, Crash per firma.
+    Solleva CancelledError se il render viene superato da uno più recente.
+    """
+    snapshot = await _load_export_snapshot(guild_id)
+    data = await _render_in_worker(guild_id, snapshot, now.strftime("%Y-%m-%d %H:%M:%S"), group_crashes)
+    return snapshot, data
+
+
+async def update_export_message(guild_id: int):
+    """Aggiorna (o crea) il messaggio pin del server con embed + file di export."""
+    generation = _export_generations[guild_id] = _export_generations.get(guild_id, 0) + 1
 
     try:
-        export_channel = bot.get_channel(EXPORT_CHANNEL_ID)
+        export_channel_id = get_guild_config(guild_id)["export_channel_id"]
+        if not export_channel_id:
+            return
+        export_channel = bot.get_channel(export_channel_id)
         if not export_channel:
-            logger.error(f"❌ Canale export {EXPORT_CHANNEL_ID} non trovato")
+            logger.error(f"❌ Canale export {export_channel_id} non trovato (server {guild_id})")
             return
 
-        file_content = await generate_export_file()
+        now = datetime.now()
+        try:
+            snapshot, file_bytes = await generate_export_file(guild_id, now)
+        except asyncio.CancelledError:
+            # nel frattempo è stato accodato un export più recente
+            logger.info(f"⏭️ Render export #{generation} annullato (superato da uno più recente)")
+            return
+
+        if generation != _export_generations[guild_id]:
+            logger.info(f"⏭️ Export #{generation} scartato (superato da uno più recente)")
+            return
 
-        import io
-        file_buffer = io.BytesIO(file_content.encode("utf-8"))
         discord_file = discord.File(
-            file_buffer, filename=f"reports_export_{datetime.now().strftime('%Y%m%d_%H%M%S')}.txt"
+            io.BytesIO(file_bytes), filename=f"reports_export_{now.strftime('%Y%m%d_%H%M%S')}.txt"
         )
 
         embed = discord.Embed(
             title="📊 Reports",
             description=(
-                f"**Total reports**: {len(classified_reports)}\n"
-                f"**Last update**: {datetime.now().strftime('%Y-%m-%d %H:%M:%S')}"
+                f"**Total reports**: {len(snapshot)}\n"
+                f"**Last update**: {now.strftime('%Y-%m-%d %H:%M:%S')}"
             ),
             color=discord.Color.blue(),
-            timestamp=datetime.now(),
+            timestamp=now,
         )
 
         # stats per priorità
         priority_stats = {}
-        for rep in classified_reports.values():
-            priority_stats[rep["priority"]] = priority_stats.get(rep["priority"], 0) + 1
+        for _, items in snapshot:
+            prio = dict(items)["priority"]
+            priority_stats[prio] = priority_stats.get(prio, 0) + 1
 
         stats_text = ""
-        for prio in ["HIGH PRIORITY", "MEDIUM PRIORITY", "LOW PRIORITY", "ALREADY SOLVED"]:
+        for prio in PRIORITY_ORDER:
             count = priority_stats.get(prio, 0)
             if count > 0:
                 stats_text += f"• {prio}: {count}\n"
@@ -394,36 +1932,97 @@ async def update_export_message():
         if stats_text:
             embed.add_field(name="📈 Statistiche per Priorità", value=stats_text, inline=False)
 
-        # rimuovi messaggio precedente se noto
-        if export_message_id:
-            try:
-                old = await export_channel.fetch_message(export_message_id)
-                await old.delete()
-            except Exception:
-                pass
-
-        sent = await export_channel.send(embed=embed, file=discord_file)
-        export_message_id = sent.id
+        # una pubblicazione alla volta: evita doppi messaggi pin se due export si sovrappongono
+        async with _export_publish_locks.setdefault(guild_id, asyncio.Lock()):
+            if generation != _export_generations[guild_id]:
+                logger.info(f"⏭️ Export #{generation} scartato prima della pubblicazione")
+                return
+
+            # tra processi: lease sul server, così un solo processo pubblica alla volta
+            if _shared_store:
+                if not await _acquire_export_lease(guild_id):
+                    logger.warning(f"⚠️ Export server {guild_id} saltato: lease tenuta da un altro processo")
+                    return
+                stored_message_id = await asyncio.to_thread(_shared_store.get_export_message_id, guild_id)
+                if stored_message_id:
+                    export_message_ids[guild_id] = stored_message_id
 
-        try:
-            await sent.pin()
-            logger.info(f"📌 Messaggio export aggiornato e fissato (ID: {export_message_id})")
-        except discord.Forbidden:
-            logger.warning("⚠️ Mancano permessi per fissare il messaggio di export")
-        except discord.HTTPException:
-            logger.warning("⚠️ Impossibile fissare il messaggio (troppi pin?)")
+            try:
+                # rimuovi messaggio precedente se noto
+                old_message_id = export_message_ids.get(guild_id)
+                if old_message_id:
+                    try:
+                        old = await export_channel.fetch_message(old_message_id)
+                        await old.delete()
+                    except Exception:
+                        pass
+
+                sent = await export_channel.send(embed=embed, file=discord_file)
+                export_message_ids[guild_id] = sent.id
+                if _shared_store:
+                    await asyncio.to_thread(_shared_store.set_export_message_id, guild_id, sent.id)
+
+                try:
+                    await sent.pin()
+                    logger.info(f"📌 Messaggio export aggiornato e fissato (ID: {sent.id}, server {guild_id})")
+                except discord.Forbidden:
+                    logger.warning("⚠️ Mancano permessi per fissare il messaggio di export")
+                except discord.HTTPException:
+                    logger.warning("⚠️ Impossibile fissare il messaggio (troppi pin?)")
+            finally:
+                if _shared_store:
+                    await asyncio.to_thread(_shared_store.release_export_lease, guild_id)
 
     except Exception as e:
         logger.error(f"❌ Errore nell'aggiornamento del messaggio di export: {e}")
 
 
+def report_channel_for(interaction: discord.Interaction, guild_id: int) -> tuple:
+    """Canale dove pubblicare il report: quello configurato, altrimenti il canale del flow.
+
+    Restituisce (canale, dedicato).
+    """
+    target_channel_id = get_guild_config(guild_id)["target_channel_id"]
+    target_channel = interaction.client.get_channel(target_channel_id) if target_channel_id else None
+    if target_channel:
+        return target_channel, True
+    return interaction.channel, False
+
+
+async def register_report_message(message_id: int, meta: dict):
+    """Collega il messaggio del report ai suoi metadati e registra la creazione nel log eventi."""
+    _report_meta[message_id] = meta
+    record_event("report_created", message_id=message_id, **meta)
+    count_shard_metric(meta.get("guild_id") or LEGACY_GUILD_ID, "reports")
+    if _shared_store:
+        # il server può passare a un altro processo (resharding): i bottoni devono ritrovare la meta
+        await asyncio.to_thread(_shared_store.save_report_meta, message_id, dict(meta))
+
+
+_REPORT_HEADER = re.compile(r"^\*\*(Bug|Crash|Todo) #(\d+)\b")
+
+
+async def get_report_meta(message_id: int):
+    """Meta del messaggio report: cache locale, poi stato condiviso. None se sconosciuta."""
+    meta = _report_meta.get(message_id)
+    if meta is None and _shared_store:
+        meta = await asyncio.to_thread(_shared_store.get_report_meta, message_id)
+        if meta is not None:
+            _report_meta[message_id] = meta
+    return meta
+
+
 # =========================
 #   PRIORITY BUTTON VIEW
 # =========================
 class PriorityOnReportView(discord.ui.View):
-    def __init__(self, *, timeout: float = 86400):
-        super().__init__(timeout=timeout)
+    """View persistente: custom_id fissi e niente timeout, registrata su ogni client in create_bot,
+    così i bottoni dei report già pubblicati funzionano anche dopo riavvii e riconnessioni."""
 
+    def __init__(self):
+        super().__init__(timeout=None)
+
+    @tracks_inflight
     async def _set_priority(self, interaction: discord.Interaction, value: str):
         msg = interaction.message
         content = msg.content or ""
@@ -446,11 +2045,22 @@ class PriorityOnReportView(discord.ui.View):
             if not inserted:
                 lines.append(f"**Priority**: {value}")
 
-        meta = _report_meta.get(msg.id, {})
-        report_type = meta.get("report_type", "Report")
+        meta = await get_report_meta(msg.id)
+        if meta is None:
+            # report senza meta (es. precedente ai metadati): tipo e ID dall'intestazione del messaggio
+            header = _REPORT_HEADER.match(content)
+            if not header:
+                # niente record fittizi "#0": meglio non classificare
+                logger.warning(f"⚠️ Metadati del report {msg.id} non trovati, classificazione ignorata")
+                return await interaction.response.send_message("❌ Report non riconosciuto.", ephemeral=True)
+            meta = {"report_type": header.group(1), "report_id": int(header.group(2))}
+            logger.warning(f"⚠️ Metadati del report {msg.id} non trovati, ricavati dal testo (#{meta['report_id']})")
+        report_type = meta["report_type"]
         origin_channel_id = meta.get("origin_channel_id")
         author_id = meta.get("author_id")
-        report_id = meta.get("report_id", 0)
+        report_id = meta["report_id"]
+        guild_id = meta.get("guild_id") or interaction.guild_id or LEGACY_GUILD_ID
+        meta = {**meta, "guild_id": guild_id}
 
         rt_lower = report_type.lower()
         if value == "ALREADY SOLVED":
@@ -459,9 +2069,12 @@ class PriorityOnReportView(discord.ui.View):
                 f"Thanks for your feedback #{report_id}, however the devs have already solved this issue "
                 "and you will find this modification in the next update."
             )
-            for child in self.children:
+            # view nuova: self può essere l'istanza condivisa registrata con add_view
+            view = PriorityOnReportView()
+            for child in view.children:
                 child.disabled = True
         else:
+            view = PriorityOnReportView()
             prio_lower = value.replace(" PRIORITY", "").lower()
             channel_notice = f"```This {rt_lower} #{report_id} has been classified as {prio_lower} priority.```"
             user_notice = (
@@ -469,12 +2082,12 @@ class PriorityOnReportView(discord.ui.View):
                 f"for now it is classified as {prio_lower} priority.```"
             )
 
-        await interaction.response.edit_message(content="\n".join(lines), view=self)
+        await interaction.response.edit_message(content="\n".join(lines), view=view)
 
         try:
-            await save_classified_report(report_id, value, meta, "\n".join(lines))
-            await update_export_message()
-            logger.info(f"📊 Export aggiornato dopo classificazione report #{report_id} ({value})")
+            await save_classified_report(report_id, value, meta, "\n".join(lines), actor=interaction.user)
+            spawn_background(update_export_message(guild_id), name=f"export-{guild_id}-{report_id}")
+            logger.info(f"📊 Export accodato dopo classificazione report #{report_id} ({value})")
         except Exception as e:
             logger.error(f"❌ Errore nell'aggiornamento export per report #{report_id}: {e}")
 
@@ -491,19 +2104,19 @@ class PriorityOnReportView(discord.ui.View):
         except Exception as e:
             logger.exception("Notifica canale origine fallita: %s", e)
 
-    @discord.ui.button(label="HIGH PRIORITY", style=discord.ButtonStyle.danger)
+    @discord.ui.button(label="HIGH PRIORITY", style=discord.ButtonStyle.danger, custom_id="report_priority:high")
     async def btn_high(self, interaction: discord.Interaction, button: discord.ui.Button):
         await self._set_priority(interaction, "HIGH PRIORITY")
 
-    @discord.ui.button(label="MEDIUM PRIORITY", style=discord.ButtonStyle.primary)
+    @discord.ui.button(label="MEDIUM PRIORITY", style=discord.ButtonStyle.primary, custom_id="report_priority:medium")
     async def btn_medium(self, interaction: discord.Interaction, button: discord.ui.Button):
         await self._set_priority(interaction, "MEDIUM PRIORITY")
 
-    @discord.ui.button(label="LOW PRIORITY", style=discord.ButtonStyle.secondary)
+    @discord.ui.button(label="LOW PRIORITY", style=discord.ButtonStyle.secondary, custom_id="report_priority:low")
     async def btn_low(self, interaction: discord.Interaction, button: discord.ui.Button):
         await self._set_priority(interaction, "LOW PRIORITY")
 
-    @discord.ui.button(label="ALREADY SOLVED", style=discord.ButtonStyle.success)
+    @discord.ui.button(label="ALREADY SOLVED", style=discord.ButtonStyle.success, custom_id="report_priority:solved")
     async def btn_solved(self, interaction: discord.Interaction, button: discord.ui.Button):
         await self._set_priority(interaction, "ALREADY SOLVED")
 
@@ -524,17 +2137,19 @@ class DescriptionModal(discord.ui.Modal, title="Breve descrizione del problema")
         )
         self.add_item(self.desc)
 
+    @tracks_inflight
     async def on_submit(self, interaction: discord.Interaction):
         if interaction.user.id != self.author_id:
             return await interaction.response.send_message("Non sei autorizzato.", ephemeral=True)
 
-        state = _active_reports.pop(self.author_id, None)
+        state = _active_reports.pop((interaction.guild_id, self.author_id), None)
         if not state:
             return await interaction.response.send_message("Sessione scaduta. Rilancia il comando.", ephemeral=True)
 
         arr = state["arr"]
         report_type = state["report_type"]
         origin_channel_id = state["origin_channel_id"]
+        guild_id = state["guild_id"]
         author_id = self.author_id
         report_id = state["report_id"]
 
@@ -542,6 +2157,19 @@ class DescriptionModal(discord.ui.Modal, title="Breve descrizione del problema")
         display_name, version, date_str, category, subcategory, description = arr
         icon = "🐞" if report_type == "Bug" else "💥"
 
+        # allegati ancora in caricamento: si rimanda la risposta invece di perderli
+        attachments = []
+        respond = interaction.response.send_message
+        attachments_task = state.get("attachments_task")
+        if attachments_task:
+            if not attachments_task.done():
+                await interaction.response.defer(ephemeral=True, thinking=True)
+                respond = interaction.followup.send
+            try:
+                attachments = await asyncio.wait_for(asyncio.shield(attachments_task), ATTACHMENT_WAIT_TIMEOUT)
+            except Exception as e:
+                logger.warning(f"⚠️ Allegati del report #{report_id} non disponibili: {e}")
+
         report_text = (
             f"**{report_type} #{report_id} - {category}/{subcategory} [{version}]**\n"
             f"{icon} **{report_type} Report #{report_id}**\n"
@@ -553,21 +2181,30 @@ class DescriptionModal(discord.ui.Modal, title="Breve descrizione del problema")
             f"**Priority**: —\n"
             f"**Description (optional)**: {description or '—'}"
         )
-
-        target_channel = interaction.client.get_channel(TARGET_CHANNEL_ID)
-        if target_channel:
-            sent = await target_channel.send(report_text, view=PriorityOnReportView())
-            _report_meta[sent.id] = {
+        if attachments:
+            report_text += f"\n**Attachments**: {format_attachments(attachments)}"
+
+        report_channel, dedicated = report_channel_for(interaction, guild_id)
+        sent = await report_channel.send(report_text, view=PriorityOnReportView())
+        await register_report_message(
+            sent.id,
+            {
                 "report_type": report_type,
+                "guild_id": guild_id,
                 "origin_channel_id": origin_channel_id,
                 "author_id": author_id,
                 "report_id": report_id,
-            }
-            await interaction.response.send_message("✅ Report inviato nel canale dedicato.", ephemeral=True)
-        else:
-            sent = await interaction.response.send_message(report_text, view=PriorityOnReportView(), ephemeral=False)
+                "attachments": attachments,
+            },
+        )
+        if attachments:
+            spawn_background(
+                bucket_crash_report(sent, guild_id, report_id, version, attachments),
+                name=f"crashsig-{guild_id}-{report_id}",
+            )
+        await respond("✅ Report inviato nel canale dedicato." if dedicated else "✅ Report inviato.", ephemeral=True)
 
-        if origin_channel_id:
+        if origin_channel_id and origin_channel_id != report_channel.id:
             origin_ch = interaction.client.get_channel(origin_channel_id)
             if origin_ch:
                 await origin_ch.send(report_text)
@@ -586,16 +2223,18 @@ class TodoDescriptionModal(discord.ui.Modal, title="Descrizione TODO"):
         )
         self.add_item(self.desc)
 
+    @tracks_inflight
     async def on_submit(self, interaction: discord.Interaction):
         if interaction.user.id != self.author_id:
             return await interaction.response.send_message("Non sei autorizzato.", ephemeral=True)
 
-        state = _active_reports.pop(self.author_id, None)
+        state = _active_reports.pop((interaction.guild_id, self.author_id), None)
         if not state:
             return await interaction.response.send_message("Sessione scaduta. Rilancia il comando.", ephemeral=True)
 
         arr = state["arr"]
         origin_channel_id = state["origin_channel_id"]
+        guild_id = state["guild_id"]
         author_id = self.author_id
         report_id = state["report_id"]
 
@@ -617,20 +2256,23 @@ class TodoDescriptionModal(discord.ui.Modal, title="Descrizione TODO"):
             f"**Description (optional)**: {description or '—'}"
         )
 
-        target_channel = interaction.client.get_channel(TARGET_CHANNEL_ID)
-        if target_channel:
-            sent = await target_channel.send(report_text, view=PriorityOnReportView())
-            _report_meta[sent.id] = {
+        report_channel, dedicated = report_channel_for(interaction, guild_id)
+        sent = await report_channel.send(report_text, view=PriorityOnReportView())
+        await register_report_message(
+            sent.id,
+            {
                 "report_type": report_type,
+                "guild_id": guild_id,
                 "origin_channel_id": origin_channel_id,
                 "author_id": author_id,
                 "report_id": report_id,
-            }
-            await interaction.response.send_message("✅ TODO inviato nel canale dedicato.", ephemeral=True)
-        else:
-            sent = await interaction.response.send_message(report_text, view=PriorityOnReportView(), ephemeral=False)
+            },
+        )
+        await interaction.response.send_message(
+            "✅ TODO inviato nel canale dedicato." if dedicated else "✅ TODO inviato.", ephemeral=True
+        )
 
-        if origin_channel_id:
+        if origin_channel_id and origin_channel_id != report_channel.id:
             origin_ch = interaction.client.get_channel(origin_channel_id)
             if origin_ch:
                 await origin_ch.send(report_text)
@@ -651,7 +2293,7 @@ class SubcategoryView(discord.ui.View):
             async def callback(interaction: discord.Interaction, chosen_label=label):
                 if interaction.user.id != self.author_id:
                     return await interaction.response.send_message("Non sei autorizzato.", ephemeral=True)
-                state = _active_reports.get(self.author_id)
+                state = _active_reports.get((interaction.guild_id, self.author_id))
                 if not state:
                     return await interaction.response.send_message("Sessione scaduta.", ephemeral=True)
                 state["arr"][4] = chosen_label  # subcategory
@@ -661,47 +2303,48 @@ class SubcategoryView(discord.ui.View):
             self.add_item(btn)
 
 
+CATEGORY_BUTTON_STYLES = [
+    discord.ButtonStyle.primary,
+    discord.ButtonStyle.secondary,
+    discord.ButtonStyle.success,
+    discord.ButtonStyle.danger,
+]
+
+
 class CategoryView(discord.ui.View):
     def __init__(self, author_id: int, *, timeout=180):
         super().__init__(timeout=180)
         self.author_id = author_id
 
+    def add_category_buttons(self, taxonomy: dict):
+        for i, category_upper in enumerate(list(taxonomy)[:MAX_TAXONOMY_BUTTONS]):
+            btn = discord.ui.Button(
+                label=category_upper.title(), style=CATEGORY_BUTTON_STYLES[i % len(CATEGORY_BUTTON_STYLES)]
+            )
+
+            async def callback(interaction: discord.Interaction, chosen=category_upper):
+                await self._handle_category(interaction, chosen)
+
+            btn.callback = callback
+            self.add_item(btn)
+
     async def _handle_category(self, interaction: discord.Interaction, category_upper: str):
         if interaction.user.id != self.author_id:
             return await interaction.response.send_message("Non sei autorizzato.", ephemeral=True)
-        state = _active_reports.get(self.author_id)
+        state = _active_reports.get((interaction.guild_id, self.author_id))
         if not state:
             return await interaction.response.send_message("Sessione scaduta.", ephemeral=True)
 
         state["arr"][3] = category_upper  # category
 
-        options_map = {
-            "MAP": ["UI", "VISUAL", "MOVING", "Other"],
-            "SETTLEMENTS": ["Slots", "Buildings", "Loc", "Non selectable", "Other"],
-            "FACTIONS": ["Leader", "Loc", "Flags", "Other"],
-            "ARMIES": ["Generals/Admirals", "Units", "Loc", "Ui", "Other"],
-        }
+        options = get_guild_config(state["guild_id"])["taxonomy"].get(category_upper)
+        if not options:
+            return await interaction.response.send_message("Categoria non più disponibile.", ephemeral=True)
         subview = SubcategoryView(self.author_id)
-        subview.add_option_buttons(options_map[category_upper])
+        subview.add_option_buttons(options[:MAX_TAXONOMY_BUTTONS])
 
         await interaction.response.send_message("Please select the **sub-category**:", view=subview, ephemeral=True)
 
-    @discord.ui.button(label="Map", style=discord.ButtonStyle.primary)
-    async def btn_map(self, interaction: discord.Interaction, button: discord.ui.Button):
-        await self._handle_category(interaction, "MAP")
-
-    @discord.ui.button(label="Settlements", style=discord.ButtonStyle.secondary)
-    async def btn_settlements(self, interaction: discord.Interaction, button: discord.ui.Button):
-        await self._handle_category(interaction, "SETTLEMENTS")
-
-    @discord.ui.button(label="Factions", style=discord.ButtonStyle.success)
-    async def btn_factions(self, interaction: discord.Interaction, button: discord.ui.Button):
-        await self._handle_category(interaction, "FACTIONS")
-
-    @discord.ui.button(label="Armies", style=discord.ButtonStyle.danger)
-    async def btn_armies(self, interaction: discord.Interaction, button: discord.ui.Button):
-        await self._handle_category(interaction, "ARMIES")
-
 
 # ---- TODO Views (senza selezione versione) ----
 class TodoSubcategoryView(discord.ui.View):
@@ -716,7 +2359,7 @@ class TodoSubcategoryView(discord.ui.View):
             async def callback(interaction: discord.Interaction, chosen_label=label):
                 if interaction.user.id != self.author_id:
                     return await interaction.response.send_message("Non sei autorizzato.", ephemeral=True)
-                state = _active_reports.get(self.author_id)
+                state = _active_reports.get((interaction.guild_id, self.author_id))
                 if not state:
                     return await interaction.response.send_message("Sessione scaduta.", ephemeral=True)
                 state["arr"][4] = chosen_label  # subcategory
@@ -726,47 +2369,24 @@ class TodoSubcategoryView(discord.ui.View):
             self.add_item(btn)
 
 
-class TodoCategoryView(discord.ui.View):
-    def __init__(self, author_id: int, *, timeout=180):
-        super().__init__(timeout=180)
-        self.author_id = author_id
-
+class TodoCategoryView(CategoryView):
     async def _handle_category(self, interaction: discord.Interaction, category_upper: str):
         if interaction.user.id != self.author_id:
             return await interaction.response.send_message("Non sei autorizzato.", ephemeral=True)
-        state = _active_reports.get(self.author_id)
+        state = _active_reports.get((interaction.guild_id, self.author_id))
         if not state:
             return await interaction.response.send_message("Sessione scaduta.", ephemeral=True)
 
         state["arr"][3] = category_upper  # category
 
-        options_map = {
-            "MAP": ["UI", "VISUAL", "MOVING", "Other"],
-            "SETTLEMENTS": ["Slots", "Buildings", "Loc", "Non selectable", "Other"],
-            "FACTIONS": ["Leader", "Loc", "Flags", "Other"],
-            "ARMIES": ["Generals/Admirals", "Units", "Loc", "Ui", "Other"],
-        }
+        options = get_guild_config(state["guild_id"])["taxonomy"].get(category_upper)
+        if not options:
+            return await interaction.response.send_message("Categoria non più disponibile.", ephemeral=True)
         subview = TodoSubcategoryView(self.author_id)
-        subview.add_option_buttons(options_map[category_upper])
+        subview.add_option_buttons(options[:MAX_TAXONOMY_BUTTONS])
 
         await interaction.response.send_message("Please select the **sub-category** for TODO:", view=subview, ephemeral=True)
 
-    @discord.ui.button(label="Map", style=discord.ButtonStyle.primary)
-    async def btn_map(self, interaction: discord.Interaction, button: discord.ui.Button):
-        await self._handle_category(interaction, "MAP")
-
-    @discord.ui.button(label="Settlements", style=discord.ButtonStyle.secondary)
-    async def btn_settlements(self, interaction: discord.Interaction, button: discord.ui.Button):
-        await self._handle_category(interaction, "SETTLEMENTS")
-
-    @discord.ui.button(label="Factions", style=discord.ButtonStyle.success)
-    async def btn_factions(self, interaction: discord.Interaction, button: discord.ui.Button):
-        await self._handle_category(interaction, "FACTIONS")
-
-    @discord.ui.button(label="Armies", style=discord.ButtonStyle.danger)
-    async def btn_armies(self, interaction: discord.Interaction, button: discord.ui.Button):
-        await self._handle_category(interaction, "ARMIES")
-
 
 class VersionView(discord.ui.View):
     def __init__(self, author_id: int, *, timeout=180):
@@ -776,14 +2396,14 @@ class VersionView(discord.ui.View):
     async def _handle_version(self, interaction: discord.Interaction, version: str):
         if interaction.user.id != self.author_id:
             return await interaction.response.send_message("Non sei autorizzato.", ephemeral=True)
-        state = _active_reports.get(self.author_id)
+        state = _active_reports.get((interaction.guild_id, self.author_id))
         if not state:
             return await interaction.response.send_message("Sessione scaduta.", ephemeral=True)
 
         state["arr"][1] = version  # version
-        await interaction.response.send_message(
-            "Please select the **category**:", view=CategoryView(self.author_id), ephemeral=True
-        )
+        view = CategoryView(self.author_id)
+        view.add_category_buttons(get_guild_config(state["guild_id"])["taxonomy"])
+        await interaction.response.send_message("Please select the **category**:", view=view, ephemeral=True)
 
     @discord.ui.button(label="0.0.0", style=discord.ButtonStyle.secondary)
     async def btn_v000(self, interaction: discord.Interaction, button: discord.ui.Button):
@@ -797,47 +2417,62 @@ class VersionView(discord.ui.View):
 # =========================
 #   HOOK: command flow
 # =========================
-@bot.event
 async def on_command_completion(ctx: commands.Context):
     try:
         if ctx.command and ctx.command.name in {"bug", "crash", "todo"}:
-            global REPORT_COUNTER
-            _active_reports.pop(ctx.author.id, None)
+            guild_id = ctx.guild.id
+            flow_key = (guild_id, ctx.author.id)
+            _active_reports.pop(flow_key, None)
 
             display_name = ctx.author.display_name
             ts: datetime = ctx.message.created_at
             date_str = ts.date().isoformat()
 
-            # Assegna ID e incrementa
-            report_id = REPORT_COUNTER
-            REPORT_COUNTER += 1
+            # Assegna ID (per server)
+            report_id = await allocate_report_id(guild_id)
+            count_shard_metric(guild_id, "commands")
 
             if ctx.command.name in {"bug", "crash"}:
                 report_type = "Bug" if ctx.command.name == "bug" else "Crash"
 
+                # log/screenshot allegati a !crash: il download parte subito, in parallelo al flow
+                attachments_task = None
+                attachments_note = ""
+                if report_type == "Crash" and ctx.message.attachments:
+                    attachments_task = spawn_background(
+                        store_attachments(ctx.message.attachments), name=f"attachments-{guild_id}-{report_id}"
+                    )
+                    count = min(len(ctx.message.attachments), ATTACHMENTS_PER_REPORT)
+                    attachments_note = f" 📎 {count} attachment(s) uploading."
+
                 await ctx.send(
-                    f"{ctx.author.mention} Select the **version** used (ID: #{report_id}):",
+                    f"{ctx.author.mention} Select the **version** used (ID: #{report_id}):{attachments_note}",
                     view=VersionView(author_id=ctx.author.id),
                 )
 
-                _active_reports[ctx.author.id] = {
+                _active_reports[flow_key] = {
                     "arr": [display_name, None, date_str, None, None, None],
                     "report_type": report_type,
+                    "guild_id": guild_id,
                     "origin_channel_id": ctx.channel.id,
                     "report_id": report_id,
                     "message_ts": ts,
+                    "attachments_task": attachments_task,
                 }
 
             elif ctx.command.name == "todo":
                 # Flow TODO: niente versione, vai direttamente a categoria -> subcategoria -> descrizione
+                view = TodoCategoryView(author_id=ctx.author.id)
+                view.add_category_buttons(get_guild_config(guild_id)["taxonomy"])
                 await ctx.send(
                     f"{ctx.author.mention} Select the **category** for TODO (ID: #{report_id}):",
-                    view=TodoCategoryView(author_id=ctx.author.id),
+                    view=view,
                 )
 
-                _active_reports[ctx.author.id] = {
+                _active_reports[flow_key] = {
                     "arr": [display_name, None, date_str, None, None, None],
                     "report_type": "Todo",
+                    "guild_id": guild_id,
                     "origin_channel_id": ctx.channel.id,
                     "report_id": report_id,
                     "message_ts": ts,
@@ -850,40 +2485,524 @@ async def on_command_completion(ctx: commands.Context):
 # =========================
 #   SHUTDOWN / MAIN LOOP
 # =========================
-async def shutdown_handler():
-    logger.info("🔴 Arresto del bot in corso...")
+def _stop_background_loops():
+    """Ferma i task periodici: ripartono dall'on_ready del prossimo client."""
     if uptime_monitor.is_running():
         uptime_monitor.cancel()
-    if channel_keepalive_pinger.is_running():
-        channel_keepalive_pinger.cancel()
+    if shared_state_sync.is_running():
+        shared_state_sync.cancel()
+    if blob_janitor.is_running():
+        blob_janitor.cancel()
+
+
+async def shutdown_handler():
+    logger.info("🔴 Arresto del bot in corso...")
+    _stop_background_loops()
     await bot.close()
 
 
-async def main():
-    global reconnection_attempts
+# =========================
+#   STATE SNAPSHOT
+# =========================
+def _state_to_dict() -> dict:
+    return {
+        "saved_at": datetime.now().isoformat(),
+        "event_seq": _event_seq,
+        "report_counters": {str(gid): n for gid, n in _report_counters.items()},
+        "export_message_ids": {str(gid): mid for gid, mid in export_message_ids.items()},
+        "classified_reports": {
+            str(gid): {str(rid): rep for rid, rep in reports.items()} for gid, reports in classified_reports.items()
+        },
+        "report_meta": {str(mid): meta for mid, meta in _report_meta.items()},
+        "crash_buckets": {str(gid): buckets for gid, buckets in crash_buckets.items()},
+    }
+
+
+def _write_json_atomic(path: str, payload: str):
+    """Scrive su file temporaneo, fsync e rename: mai un file a metà.
+
+    payload è il JSON già serializzato: json.dumps va fatto sull'event loop, perché nel
+    thread i dict annidati dello stato potrebbero cambiare mentre vengono letti.
+    """
+    os.makedirs(os.path.dirname(path) or ".", exist_ok=True)
+    tmp_path = f"{path}.tmp"
+    with open(tmp_path, "w", encoding="utf-8") as f:
+        f.write(payload)
+        f.flush()
+        os.fsync(f.fileno())
+    os.replace(tmp_path, path)
+
+
+async def write_state_snapshot():
+    """Snapshot su disco + compattazione del log eventi già coperto dallo snapshot."""
+    global _snapshot_event_seq
+    async with _event_log_lock:
+        await _flush_events_locked()
+        # stato e sequenza letti e serializzati insieme, senza await in mezzo:
+        # lo snapshot copre esattamente fino a seq
+        started = time.perf_counter()
+        data = _state_to_dict()
+        payload = json.dumps(data, ensure_ascii=False)
+        await asyncio.to_thread(_write_json_atomic, STATE_FILE, payload)
+        await asyncio.to_thread(_archive_event_log)
+        _snapshot_event_seq = data["event_seq"]
+    logger.info(
+        f"💾 Snapshot stato salvato in {(time.perf_counter() - started) * 1000:.1f}ms "
+        f"({_total_reports()} report in {len(classified_reports)} server, evento #{data['event_seq']})"
+    )
+
+
+def load_state_snapshot():
+    """Ricarica l'ultimo snapshot e rigioca il tail del log eventi, prima di connettersi."""
+    global _event_seq, _snapshot_event_seq
+    started = time.perf_counter()
+    try:
+        with open(STATE_FILE, encoding="utf-8") as f:
+            data = json.load(f)
+    except FileNotFoundError:
+        logger.info("ℹ️ Nessuno snapshot di stato da ricaricare")
+        data = {}
+    except (OSError, ValueError) as e:
+        logger.error(f"❌ Snapshot di stato illeggibile ({STATE_FILE}): {e}")
+        data = {}
+
+    if "report_counters" in data:
+        for gid, reports in data.get("classified_reports", {}).items():
+            classified_reports[int(gid)] = {int(rid): rep for rid, rep in reports.items()}
+        _report_counters.update({int(gid): n for gid, n in data["report_counters"].items()})
+        export_message_ids.update({int(gid): mid for gid, mid in data.get("export_message_ids", {}).items()})
+    elif data:
+        # snapshot pre multi-server: tutto sotto LEGACY_GUILD_ID finché non si conosce il server
+        classified_reports[LEGACY_GUILD_ID] = {int(rid): rep for rid, rep in data.get("classified_reports", {}).items()}
+        _report_counters[LEGACY_GUILD_ID] = int(data.get("report_counter", 1))
+        if data.get("export_message_id"):
+            export_message_ids[LEGACY_GUILD_ID] = data["export_message_id"]
+    _report_meta.update({int(mid): meta for mid, meta in data.get("report_meta", {}).items()})
+    crash_buckets.update({int(gid): buckets for gid, buckets in data.get("crash_buckets", {}).items()})
+    _event_seq = _snapshot_event_seq = int(data.get("event_seq", 0))
+
+    replayed = 0
+    if not data:
+        # snapshot assente o illeggibile: lo stato si ricostruisce dall'archivio, poi dal log attivo
+        replayed += _replay_event_log(0, EVENT_ARCHIVE_FILE)
+    replayed += _replay_event_log(_event_seq)
+    # la sequenza non deve mai ripartire sotto l'archivio, o _archive_event_log scarterebbe i nuovi eventi
+    _event_seq = max(_event_seq, _last_archived_seq()[0])
+    if data or replayed:
+        logger.info(
+            f"♻️ Stato ricaricato in {(time.perf_counter() - started) * 1000:.1f}ms "
+            f"(snapshot del {data.get('saved_at', '—')} + {replayed} eventi): "
+            f"{_total_reports()} report in {len(classified_reports)} server"
+        )
+
+
+def _total_reports() -> int:
+    return sum(len(reports) for reports in classified_reports.values())
+
+
+# =========================
+#        EVENT LOG
+# =========================
+# Ogni creazione di report e cambio di priorità viene accodato come riga JSON:
+# {"seq": int, "ts": iso, "type": "report_created"|"priority_changed", ...campi}
+# Il log attivo contiene solo gli eventi successivi all'ultimo snapshot; quelli
+# già compattati finiscono in EVENT_ARCHIVE_FILE come storico (audit).
+def record_event(event_type: str, **fields) -> dict:
+    """Accoda un evento: finisce su disco al prossimo flush (fsync a batch)."""
+    global _event_seq
+    _event_seq += 1
+    event = {"seq": _event_seq, "ts": datetime.now().isoformat(), "type": event_type, **fields}
+    _event_buffer.append(json.dumps(event, ensure_ascii=False))
+    return event
+
+
+def _append_lines_fsync(path: str, lines: list):
+    os.makedirs(os.path.dirname(path) or ".", exist_ok=True)
+    with open(path, "a", encoding="utf-8") as f:
+        f.write("\n".join(lines) + "\n")
+        f.flush()
+        os.fsync(f.fileno())
+
+
+def _last_archived_seq() -> tuple:
+    """Ultimo seq già in archivio e se il file termina con un a capo (legge solo la coda)."""
+    try:
+        with open(EVENT_ARCHIVE_FILE, "rb") as f:
+            f.seek(0, os.SEEK_END)
+            size = f.tell()
+            f.seek(max(0, size - 64 * 1024))
+            tail = f.read()
+    except FileNotFoundError:
+        return 0, True
+    for line in reversed(tail.splitlines()):
+        try:
+            return int(json.loads(line)["seq"]), tail.endswith(b"\n")
+        except (ValueError, KeyError, TypeError):
+            continue    # riga troncata da un crash a metà scrittura
+    return 0, not tail or tail.endswith(b"\n")
+
+
+def _archive_event_log():
+    """Sposta il log attivo (già coperto dallo snapshot) in coda all'archivio.
+
+    Append e troncamento non sono atomici insieme: se si muore tra i due, alla compattazione
+    successiva gli eventi con seq già in archivio vengono saltati invece di essere duplicati.
+    """
+    try:
+        with open(EVENT_LOG_FILE, encoding="utf-8") as src:
+            lines = src.read().splitlines()
+    except FileNotFoundError:
+        return
+    last_seq, ends_with_newline = _last_archived_seq()
+    pending = []
+    for line in lines:
+        try:
+            if int(json.loads(line)["seq"]) > last_seq:
+                pending.append(line)
+        except (ValueError, KeyError, TypeError):
+            continue
+    if pending:
+        with open(EVENT_ARCHIVE_FILE, "a", encoding="utf-8") as dst:
+            dst.write(("" if ends_with_newline else "\n") + "\n".join(pending) + "\n")
+            dst.flush()
+            os.fsync(dst.fileno())
+    # troncato solo dopo che l'archivio è su disco
+    with open(EVENT_LOG_FILE, "w", encoding="utf-8") as f:
+        f.flush()
+        os.fsync(f.fileno())
+
+
+async def _flush_events_locked():
+    if not _event_buffer:
+        return
+    batch = _event_buffer[:]
+    _event_buffer.clear()
+    try:
+        await asyncio.to_thread(_append_lines_fsync, EVENT_LOG_FILE, batch)
+    except OSError as e:
+        # rimetti in testa al buffer: si riprova al prossimo giro
+        _event_buffer[:0] = batch
+        logger.error(f"❌ Scrittura log eventi fallita ({len(batch)} eventi in attesa): {e}")
+
+
+async def flush_events():
+    async with _event_log_lock:
+        await _flush_events_locked()
+
+
+def _apply_event(event: dict):
+    """Applica un evento allo stato in memoria (usato nel replay)."""
+    event_type = event.get("type")
+    guild_id = event.get("guild_id") or LEGACY_GUILD_ID
+    report_id = int(event["report_id"])
+    if event_type == "report_created":
+        meta = {k: event.get(k) for k in ("report_type", "guild_id", "origin_channel_id", "author_id", "report_id")}
+        meta["attachments"] = event.get("attachments", [])
+        _report_meta[int(event["message_id"])] = meta
+    elif event_type == "priority_changed":
+        classified_reports.setdefault(guild_id, {})[report_id] = event["record"]
+    elif event_type == "crash_bucketed":
+        _add_to_bucket(guild_id, report_id, event, event.get("version"))
+        meta = _report_meta.get(int(event.get("message_id") or 0))
+        if meta is not None:
+            meta["crash_signature"] = event["signature"]
+        record = classified_reports.get(guild_id, {}).get(report_id)
+        if record is not None:
+            record["crash_signature"] = event["signature"]
+    else:
+        return
+    _report_counters[guild_id] = max(_report_counters.get(guild_id, 1), report_id + 1)
+
+
+def _replay_event_log(after_seq: int, path: str = EVENT_LOG_FILE) -> int:
+    """Rigioca gli eventi con seq > after_seq. Ritorna quanti ne ha applicati."""
+    global _event_seq
+    replayed = 0
+    try:
+        with open(path, encoding="utf-8") as f:
+            for line_no, line in enumerate(f, 1):
+                line = line.strip()
+                if not line:
+                    continue
+                try:
+                    event = json.loads(line)
+                except ValueError:
+                    # tipicamente l'ultima riga troncata da un crash a metà scrittura
+                    logger.warning(f"⚠️ Riga {line_no} del log eventi illeggibile, ignorata")
+                    continue
+                if event.get("seq", 0) <= after_seq:
+                    continue
+                _apply_event(event)
+                _event_seq = max(_event_seq, event["seq"])
+                replayed += 1
+    except FileNotFoundError:
+        pass
+    return replayed
+
+
+async def event_log_writer():
+    """Flush periodico del log eventi e snapshot/compattazione quando serve."""
+    last_snapshot = time.monotonic()
     while True:
+        await asyncio.sleep(EVENT_LOG_FSYNC_INTERVAL)
+        try:
+            await flush_events()
+            if time.monotonic() - last_snapshot >= STATE_SNAPSHOT_INTERVAL:
+                last_snapshot = time.monotonic()
+                if _event_seq > _snapshot_event_seq:
+                    await write_state_snapshot()
+        except Exception as e:
+            logger.error(f"❌ Errore nel writer del log eventi: {e}")
+
+
+async def _drain_pending(timeout: float):
+    """Attende flow in corso e task in uscita fino alla scadenza."""
+    loop = asyncio.get_running_loop()
+    deadline = loop.time() + timeout
+    while loop.time() < deadline:
+        pending = {t for t in _background_tasks if not t.done()}
+        if not pending and _inflight_flows == 0:
+            return True
+        remaining = deadline - loop.time()
+        if pending:
+            await asyncio.wait(pending, timeout=min(0.5, remaining))
+        else:
+            await asyncio.sleep(min(0.1, remaining))
+    return False
+
+
+async def graceful_shutdown(reason: str):
+    """Drain + snapshot + close: usato su SIGTERM (deploy/restart del dyno)."""
+    global _shutting_down
+    if _shutting_down:
+        return
+    _shutting_down = True
+    _shutdown_event.set()
+    logger.info(f"🛑 {reason} ricevuto: stop ai nuovi flow, drain (max {SHUTDOWN_DRAIN_TIMEOUT:.0f}s)...")
+
+    drained = await _drain_pending(SHUTDOWN_DRAIN_TIMEOUT)
+    if not drained:
+        logger.warning(
+            f"⚠️ Drain incompleto: {_inflight_flows} flow in corso, "
+            f"{sum(1 for t in _background_tasks if not t.done())} task in uscita abbandonati"
+        )
+
+    try:
+        await write_state_snapshot()
+    except Exception as e:
+        logger.error(f"❌ Errore nel salvataggio dello snapshot: {e}")
+
+    if bot and not bot.is_closed():
+        await shutdown_handler()
+
+
+_shutdown_task = None
+
+
+def _on_shutdown_signal(sig: signal.Signals):
+    global _shutdown_task
+    if _shutdown_task is None:
+        # non va in _background_tasks: il drain aspetterebbe se stesso
+        _shutdown_task = asyncio.create_task(graceful_shutdown(sig.name), name="shutdown")
+
+
+def _install_signal_handlers():
+    loop = asyncio.get_running_loop()
+    for sig in (signal.SIGTERM, signal.SIGINT):
+        try:
+            loop.add_signal_handler(sig, _on_shutdown_signal, sig)
+        except (NotImplementedError, RuntimeError):
+            # es. Windows: resta solo il KeyboardInterrupt
+            pass
+
+
+async def main():
+    global _shared_store
+    load_state_snapshot()
+    if SHARED_STATE_DB:
+        _shared_store = SharedStore(SHARED_STATE_DB)
+        if not SHARD_PROCESS_INDEX:
+            # processo singolo: l'import lo fa lui (coi processi shard lo fa il launcher)
+            import_local_state(_shared_store)
+    load_guild_configs()
+    load_shared_state()
+    _install_signal_handlers()
+    lag_task = asyncio.create_task(loop_lag_probe())
+    watchdog_task = asyncio.create_task(health_watchdog())
+    event_task = asyncio.create_task(event_log_writer())
+    health_server = await start_health_server()
+    try:
+        await _run_bot()
+    finally:
+        # SIGTERM durante il backoff: _run_bot esce subito, ma drain e snapshot devono finire
+        if _shutdown_task is not None:
+            try:
+                await _shutdown_task
+            except Exception as e:
+                logger.error(f"❌ Errore nello spegnimento controllato: {e}")
+        lag_task.cancel()
+        watchdog_task.cancel()
+        event_task.cancel()
+        await flush_events()
+        if health_server:
+            health_server.close()
+        if _http_session and not _http_session.closed:
+            await _http_session.close()
+        _export_executor.shutdown(wait=False, cancel_futures=True)
+        _crash_executor.shutdown(wait=False, cancel_futures=True)
+
+
+def _reconnect_delay(failures: int) -> float:
+    """Backoff esponenziale con jitter: metà fissa + metà casuale, limitato a RECONNECT_MAX_DELAY."""
+    cap = min(RECONNECT_MAX_DELAY, RECONNECT_BASE_DELAY * (2 ** max(0, failures - 1)))
+    return cap / 2 + random.uniform(0, cap / 2)
+
+
+_exit_code: int = 0
+
+
+async def _run_bot():
+    """Supervisor: un client nuovo per ogni tentativo, budget di errori su finestra mobile."""
+    global bot, reconnection_attempts, _consecutive_failures, gateway_connected, _exit_code
+    while not _shutting_down:
+        bot = create_bot()
         try:
             logger.info("🚀 Avvio del bot Discord...")
             await bot.start(token)
-        except discord.errors.ConnectionClosed:
-            logger.warning("🔄 Connessione chiusa, tentativo di riconnessione...")
-            reconnection_attempts += 1
-            await asyncio.sleep(5)
+            # start() ritorna solo dopo una close() voluta
+            logger.info("🔌 Client chiuso, il supervisor termina.")
+            break
         except discord.errors.LoginFailure:
             logger.error("❌ Errore di autenticazione! Verificare il token Discord.")
+            _exit_code = EXIT_LOGIN_FAILURE
             break
+        except discord.errors.ConnectionClosed as e:
+            logger.warning(f"🔄 Connessione chiusa (code {e.code}), tentativo di riconnessione...")
         except Exception as e:
             logger.error(f"❌ Errore inaspettato: {e}")
-            reconnection_attempts += 1
-            await asyncio.sleep(10)
+        finally:
+            _stop_background_loops()
+            if not bot.is_closed():
+                await bot.close()
+
+        if _shutting_down:
+            break
 
-        if reconnection_attempts > 5:
-            logger.error("❌ Troppi tentativi di riconnessione falliti. Arresto.")
+        gateway_connected = False
+        _mark_outage_start()
+        reconnection_attempts += 1
+        _consecutive_failures += 1
+
+        now = time.monotonic()
+        _reconnect_failures.append(now)
+        while _reconnect_failures and now - _reconnect_failures[0] > RECONNECT_FAILURE_WINDOW:
+            _reconnect_failures.popleft()
+
+        if len(_reconnect_failures) > RECONNECT_MAX_FAILURES:
+            logger.error(
+                f"❌ Troppi tentativi di riconnessione falliti "
+                f"({len(_reconnect_failures)} nell'ultima ora). Arresto."
+            )
+            _exit_code = EXIT_RECONNECT_BUDGET
             break
 
+        delay = _reconnect_delay(_consecutive_failures)
+        logger.info(f"⏳ Nuovo tentativo tra {delay:.1f}s (errore consecutivo #{_consecutive_failures})")
+        try:
+            await asyncio.wait_for(_shutdown_event.wait(), timeout=delay)
+        except asyncio.TimeoutError:
+            pass
+
+
+def run_shard_launcher():
+    """Divide SHARD_COUNT shard tra SHARD_PROCESSES processi figli e li riavvia con backoff esponenziale.
+
+    Si ferma su segnale, o per tutti i figli se uno esce con EXIT_LOGIN_FAILURE (il token vale per tutti).
+    """
+    if not SHARD_COUNT:
+        logger.error("❌ SHARD_PROCESSES richiede SHARD_COUNT.")
+        sys.exit(1)
+
+    shared_db = SHARED_STATE_DB or os.path.join(DATA_DIR, "shared.db")
+    groups = [g for g in (list(range(SHARD_COUNT))[i::SHARD_PROCESSES] for i in range(SHARD_PROCESSES)) if g]
+    # stato del deployment a processo singolo (DATA_DIR) nel DB condiviso, prima di avviare i figli:
+    # ognuno ha il suo DATA_DIR e non leggerebbe mai state.json, events.log e guild_config.json
+    load_state_snapshot()
+    import_local_state(SharedStore(shared_db))
+
+    children = {}       # index -> Popen
+    started = {}        # index -> time.monotonic() dell'avvio
+    restarts = {}       # index -> riavvii consecutivi (azzerati se il figlio resta su per una finestra)
+    restart_at = {}     # index -> time.monotonic() del prossimo riavvio
+    stopping = False
+    exit_code = 0
+
+    def spawn(index: int) -> subprocess.Popen:
+        env = dict(
+            os.environ,
+            SHARD_COUNT=str(SHARD_COUNT),
+            SHARD_IDS=",".join(map(str, groups[index])),
+            SHARD_PROCESSES="1",
+            SHARD_PROCESS_INDEX=str(index),
+            SHARED_STATE_DB=shared_db,
+            DATA_DIR=os.path.join(DATA_DIR, f"shard-{index}"),  # log eventi e snapshot restano per processo
+            HEALTH_PORT=str(HEALTH_PORT + index),
+        )
+        logger.info(f"🧩 Avvio processo shard #{index} (shard {groups[index]})")
+        started[index] = time.monotonic()
+        return subprocess.Popen([sys.executable, os.path.abspath(__file__)], env=env)
+
+    def forward(signum, frame):
+        nonlocal stopping
+        stopping = True
+        for proc in children.values():
+            proc.send_signal(signum)
+
+    signal.signal(signal.SIGTERM, forward)
+    signal.signal(signal.SIGINT, forward)
+
+    for index in range(len(groups)):
+        children[index] = spawn(index)
+
+    while children or restart_at:
+        now = time.monotonic()
+        for index, proc in list(children.items()):
+            code = proc.poll()
+            if code is None:
+                continue
+            del children[index]
+            if stopping:
+                continue
+            if code == EXIT_LOGIN_FAILURE:
+                logger.error(f"❌ Processo shard #{index}: autenticazione fallita, arresto di tutti i processi.")
+                exit_code = EXIT_LOGIN_FAILURE
+                forward(signal.SIGTERM, None)
+                continue
+            if now - started[index] > RECONNECT_FAILURE_WINDOW:
+                restarts[index] = 0
+            restarts[index] = restarts.get(index, 0) + 1
+            delay = min(RECONNECT_FAILURE_WINDOW, LAUNCHER_RESTART_BASE_DELAY * 2 ** (restarts[index] - 1))
+            reason = "budget di riconnessione esaurito" if code == EXIT_RECONNECT_BUDGET else f"exit {code}"
+            logger.warning(f"⚠️ Processo shard #{index} terminato ({reason}), riavvio tra {delay:.0f}s")
+            restart_at[index] = now + delay
+
+        for index, when in list(restart_at.items()):
+            if stopping:
+                del restart_at[index]
+            elif now >= when:
+                del restart_at[index]
+                children[index] = spawn(index)
+        time.sleep(1)
+    logger.info("🛑 Tutti i processi shard terminati.")
+    sys.exit(exit_code)
+
 
 if __name__ == "__main__":
-    try:
-        asyncio.run(main())
-    except KeyboardInterrupt:
-        logger.info("🛑 Arresto manuale del bot.")
+    if SHARD_PROCESSES > 1 and not SHARD_PROCESS_INDEX:
+        run_shard_launcher()
+    else:
+        try:
+            asyncio.run(main())
+        except KeyboardInterrupt:
+            logger.info("🛑 Arresto manuale del bot.")
+        sys.exit(_exit_code)